@@ -1,7 +1,19 @@
 import dash
 import dash_bootstrap_components as dbc
+from apps import api
+from apps import export
+from apps import metrics
+from apps import profiling
 # meta_tags are required for the app layout to be mobile responsive
 app = dash.Dash(__name__, suppress_callback_exceptions=True,
                 meta_tags=[{'name': 'viewport','content': 'width=device-width, initial-scale=1.0'}]
             )
-server = app.server
\ No newline at end of file
+server = app.server
+#Latency and payload metrics of the callbacks, served on /metrics (See apps/metrics.py)
+metrics.instrument(app)
+#Sampled profiling of the callbacks, enabled with PROFILE_RATE (See apps/profiling.py)
+profiling.instrument(app)
+#JSON API for batches of radar and recommendation queries (See apps/api.py)
+api.register(app)
+#Streaming export of the full radar matrices (See apps/export.py)
+export.register(app)
@@ -0,0 +1,166 @@
+import flask
+import json
+import os
+import pandas as pd
+from apps import cluster
+from apps import country_index
+from apps import figure_cache
+from apps import metrics
+from apps import radar_df
+from apps import ranking
+
+#---------------------------------------------------------------
+# API configuration
+#Maximum number of queries in one request
+API_MAX_BATCH = int(os.environ.get("API_MAX_BATCH", "1000"))
+RADAR_VERSIONS = ["Competitividad", "Oportunidad"]
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+#----------------------------------------------------------------------------
+# This module serves the radar scores and the recommended countries as a JSON API on the Flask server of the app, for the tools
+# that would otherwise call the Dash callbacks. Every endpoint takes a batch of queries in one POST:
+#   /api/radar/products         {"queries": [{"countries": ["Chile", ...], "products": ["090111", ...], "radar_v": "Competitividad"}]}
+#   /api/radar/sectors          {"queries": [{"countries": [...], "sector": "Agroindustrial", "subsector": null, "radar_v": ...}]}
+#   /api/recommendations        {"queries": [{"product": "090111", "country": "CHL", "radar_v": ..., "mode": "cluster", "k": 4}]}
+#   /api/markets                {"queries": [{"products": ["090111", ...], "radar_v": ..., "n": 10, "weights": {"Arancel": 2}}]}
+#   /api/country-top            {"queries": [{"country": "CHL", "level": "producto", "k": 10, "by": "Puntaje", "weights": {"Demanda": 2}}]}
+# A markets query without "products" ranks all the products. A country-top query ranks by "weights" when they are given.
+# The answer has one result per query, in the same order: {"results": [{"table": {"columns": [...], "data": [[...]]}, ...}]}.
+# A query that fails gets {"error": "..."} instead, without failing the others. The result of each query is kept in the
+# figure cache, like the callback outputs. With "format": "arrow" (or the Arrow mimetype in the Accept header) the tables of
+# all the queries are returned in a single Arrow stream with a "query" column, and the rest of each result in its metadata.
+# Arrow needs pyarrow, which is optional.
+
+#Raised when a query is not valid
+class QueryError(ValueError):
+    pass
+
+#Function to check a field of a query and return it
+def getField(query, name, kind, required=True):
+    value = query.get(name)
+    if value is None and not required:
+        return None
+    if not isinstance(value, kind):
+        raise QueryError(f"'{name}' must be a {kind.__name__}")
+    if isinstance(value, list) and (not value or not all(isinstance(item, str) for item in value)):
+        raise QueryError(f"'{name}' must be a non-empty list of strings")
+    return value
+
+#Function to check a field of a query that takes one of some values. The default is the first value
+def getChoice(query, name, choices, default=None):
+    value = query.get(name, choices[0] if default is None else default)
+    #JSON true and 4.0 are equal to 1 and 4, but only integers are valid positions of a range
+    if isinstance(choices, range) and (not isinstance(value, int) or isinstance(value, bool)):
+        raise QueryError(f"'{name}' must be one of {choices}")
+    if value not in choices:
+        raise QueryError(f"'{name}' must be one of {choices}")
+    return value
+
+#Function to serialize a dataframe as a compact table: its columns and its rows
+def tableJson(df):
+    return df.to_json(orient="split", index=False, force_ascii=False)
+
+#Functions of each endpoint. Each one gets the arguments of a query, checked and sorted so equal queries share the cache,
+#and returns its result serialized to JSON
+def radarProducts(countries, products, radar_v):
+    dff_0, recommendation = radar_df.get_radar_products(list(countries), list(products), radar_v)
+    return f'{{"table": {tableJson(dff_0)}, "recommendation": {json.dumps(" ".join(recommendation.split()), ensure_ascii=False)}}}'
+
+def radarSectors(countries, sector, subsector, radar_v):
+    return f'{{"table": {tableJson(radar_df.get_radar_sectors(list(countries), sector, subsector, radar_v))}}}'
+
+def recommendations(product, country, radar_v, mode, k):
+    countries = cluster.getRecommendedCountries(product, country, radar_v, mode, k)
+    return f'{{"table": {tableJson(pd.DataFrame({"Nombre_pais": countries}))}}}'
+
+def markets(products, radar_v, n, weights):
+    if products is None:
+        return f'{{"table": {tableJson(ranking.rankAllMarkets(radar_v, n, dict(weights)))}}}'
+    return f'{{"table": {tableJson(ranking.rankMarkets(list(products), radar_v, n, dict(weights)))}}}'
+
+def countryTop(country, level, k, by, weights):
+    return f'{{"table": {tableJson(country_index.topItems(level, country, k, by, dict(weights) or None))}}}'
+
+#Function to check the weights of the axes of a markets query, as sorted (axis, weight) pairs
+def getWeights(query):
+    weights = query.get("weights") or {}
+    #bool is a subclass of int, so true and false are rejected explicitly
+    if not isinstance(weights, dict) or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in weights.values()):
+        raise QueryError("'weights' must be an object with a number for each axis")
+    return tuple(sorted(weights.items()))
+
+#Name of each endpoint and a function to get the sorted arguments of its queries
+ENDPOINTS = {
+    "products": (radarProducts, lambda query: (tuple(sorted(getField(query, "countries", list))),
+                                               tuple(sorted(getField(query, "products", list))), getChoice(query, "radar_v", RADAR_VERSIONS))),
+    "sectors": (radarSectors, lambda query: (tuple(sorted(getField(query, "countries", list))), getField(query, "sector", str),
+                                             getField(query, "subsector", str, required=False), getChoice(query, "radar_v", RADAR_VERSIONS))),
+    "recommendations": (recommendations, lambda query: (getField(query, "product", str), getField(query, "country", str),
+                                                        getChoice(query, "radar_v", RADAR_VERSIONS),
+                                                        getChoice(query, "mode", ["cluster", "neighbors"]), getChoice(query, "k", range(1, 21), 4))),
+    "markets": (markets, lambda query: (tuple(getField(query, "products", list, required=False) or ()) or None,
+                                        getChoice(query, "radar_v", RADAR_VERSIONS), getChoice(query, "n", range(1, 251), 10), getWeights(query))),
+    "country_top": (countryTop, lambda query: (getField(query, "country", str), getChoice(query, "level", ["producto", "subsector", "sector"]),
+                                               getChoice(query, "k", range(1, 1001), 10), getChoice(query, "by", list(country_index.RANKINGS)),
+                                               getWeights(query))),
+}
+
+#Function to get the serialized result of a query, from the figure cache or computing it
+def runQuery(name, query):
+    func, getArgs = ENDPOINTS[name]
+    try:
+        if not isinstance(query, dict):
+            raise QueryError("every query must be an object")
+        args = getArgs(query)
+        key = figure_cache.cacheKey(f"api_{name}", args)
+        payload, result = figure_cache.lookup(key)
+        metrics.recordCache(f"api_{name}", result)
+        if payload is None:
+            payload = func(*args)
+            figure_cache.put(key, payload)
+        return payload
+    except Exception as e:
+        return json.dumps({"error": f"{type(e).__name__}: {e}"}, ensure_ascii=False)
+
+#Function to join the results of the queries in an Arrow stream, with the tables in one table and the rest in its metadata
+def arrowResponse(payloads):
+    import pyarrow
+    tables, results = [], []
+    for idx, payload in enumerate(payloads):
+        result = json.loads(payload)
+        table = result.pop("table", None)
+        if table is not None:
+            tables.append(pd.DataFrame(table["data"], columns=table["columns"]).assign(query=idx))
+        results.append(result)
+    df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame({"query": []})
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"results": json.dumps(results).encode()})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return flask.Response(sink.getvalue().to_pybytes(), mimetype=ARROW_MIMETYPE)
+
+#Function to answer a batch of queries of an endpoint
+def answerBatch(name):
+    body = flask.request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("queries"), list):
+        return flask.jsonify(error='The body must be a JSON object with a list of "queries"'), 400
+    if len(body["queries"]) > API_MAX_BATCH:
+        return flask.jsonify(error=f"At most {API_MAX_BATCH} queries per request"), 413
+    payloads = [runQuery(name, query) for query in body["queries"]]
+    if body.get("format") == "arrow" or ARROW_MIMETYPE in flask.request.headers.get("Accept", ""):
+        try:
+            return arrowResponse(payloads)
+        except ImportError:
+            return flask.jsonify(error="The Arrow format needs pyarrow, which is not installed"), 406
+    #The results are already serialized, so they are joined without parsing them again
+    return flask.Response(f'{{"results": [{", ".join(payloads)}]}}', mimetype="application/json")
+
+#Function to add the API routes to the Flask server of a Dash app
+def register(app):
+    server = app.server
+    server.add_url_rule("/api/radar/products", "api_products", lambda: answerBatch("products"), methods=["POST"])
+    server.add_url_rule("/api/radar/sectors", "api_sectors", lambda: answerBatch("sectors"), methods=["POST"])
+    server.add_url_rule("/api/recommendations", "api_recommendations", lambda: answerBatch("recommendations"), methods=["POST"])
+    server.add_url_rule("/api/markets", "api_markets", lambda: answerBatch("markets"), methods=["POST"])
+    server.add_url_rule("/api/country-top", "api_country_top", lambda: answerBatch("country_top"), methods=["POST"])
@@ -0,0 +1,122 @@
+import numpy as np
+from apps import cluster
+from apps import score_engine
+
+#----------------------------------------------------------------------------
+# This module fits the k-means model of many products at once. Between products only the Arancel and Demanda columns change,
+# so the data of a batch of products is a 3-D array of shape (products, countries, features) and every step of the
+# algorithm (k-means++ initialization, Lloyd iterations and silhouette score) is done for all the products with array operations.
+# The results follow the same definitions as cluster.doClusters, but the labels can differ from scikit-learn because the
+# random initialization is not the same.
+
+#Function to scale every column of every product to the 0-1 range, like preprocessing.MinMaxScaler
+def scaleMinMax(X):
+    x_min = X.min(axis=-2, keepdims=True)
+    x_range = X.max(axis=-2, keepdims=True) - x_min
+    #Constant columns are left at 0, as MinMaxScaler does
+    x_range[x_range == 0] = 1
+    return (X - x_min) / x_range
+
+#Function to get the normalized features of a batch of products with shape (products, countries, features), and the countries dataframe
+def getBatchFeatures(productos, radar_v):
+    df_countries, columns = cluster.getCountryData(radar_v)
+    index_columns = [c for c in columns if c not in ["Arancel", "Demanda"]]
+    #The country indexes are scaled once and shared by all the products
+    X_countries = scaleMinMax(np.nan_to_num(df_countries[index_columns].to_numpy(dtype=np.float64)))
+    X_products = scaleMinMax(np.nan_to_num(score_engine.getScores("producto", productos, df_countries["iso3"], ["Arancel", "Demanda"])))
+    X_countries = np.broadcast_to(X_countries, (len(productos),) + X_countries.shape)
+    return np.concatenate([X_countries, X_products], axis=2), df_countries
+
+#Function to get the squared distances between every point and every center of each product. (m,n,d) and (m,k,d) -> (m,n,k)
+def squaredDistances(X, centers):
+    distances = (np.einsum("mnd,mnd->mn", X, X)[:, :, None]
+                 - 2 * np.einsum("mnd,mkd->mnk", X, centers)
+                 + np.einsum("mkd,mkd->mk", centers, centers)[:, None, :])
+    return np.maximum(distances, 0)
+
+#Function to choose the initial centers of each product with the k-means++ method
+def initCenters(X, n_clusters, rng):
+    m, n, d = X.shape
+    rows = np.arange(m)
+    centers = np.empty((m, n_clusters, d))
+    centers[:, 0] = X[rows, rng.integers(n, size=m)]
+    closest = ((X - centers[:, :1]) ** 2).sum(axis=2)
+    for c in range(1, n_clusters):
+        #Every product picks its next center with probability proportional to the squared distance to the closest center
+        cumulative = closest.cumsum(axis=1)
+        threshold = rng.random(m) * cumulative[:, -1]
+        idx = np.minimum((cumulative < threshold[:, None]).sum(axis=1), n - 1)
+        centers[:, c] = X[rows, idx]
+        closest = np.minimum(closest, ((X - centers[:, c:c + 1]) ** 2).sum(axis=2))
+    return centers
+
+#Function to do the Lloyd iterations of all the products until every one of them converges
+def lloyd(X, centers, max_iter, tol):
+    n_clusters = centers.shape[1]
+    for _ in range(max_iter):
+        labels = squaredDistances(X, centers).argmin(axis=2)
+        onehot = (labels[:, :, None] == np.arange(n_clusters)).astype(X.dtype)
+        counts = onehot.sum(axis=1)
+        sums = np.einsum("mnk,mnd->mkd", onehot, X)
+        #Empty clusters keep their previous center
+        new_centers = np.where(counts[:, :, None] > 0, sums / np.maximum(counts, 1)[:, :, None], centers)
+        shift = ((new_centers - centers) ** 2).sum(axis=(1, 2))
+        centers = new_centers
+        if (shift <= tol).all():
+            break
+    distances = squaredDistances(X, centers)
+    labels = distances.argmin(axis=2)
+    inertia = np.take_along_axis(distances, labels[:, :, None], axis=2)[:, :, 0].sum(axis=1)
+    return labels, distances, inertia
+
+#Function to fit the k-means model of every product. Returns the labels and the distance of each country to its centroid, both (products, countries)
+def batchKMeans(X, n_clusters, n_init=10, max_iter=300, tol=1e-4, random_state=7):
+    rng = np.random.default_rng(random_state)
+    #Same tolerance as scikit-learn: relative to the mean variance of the features of each product
+    tol = tol * X.var(axis=1).mean(axis=1)
+    best_labels, best_distances, best_inertia = None, None, None
+    for _ in range(n_init):
+        labels, distances, inertia = lloyd(X, initCenters(X, n_clusters, rng), max_iter, tol)
+        if best_inertia is None:
+            best_labels, best_distances, best_inertia = labels, distances, inertia
+        else:
+            #Each product keeps the run with the lowest inertia
+            better = inertia < best_inertia
+            best_labels = np.where(better[:, None], labels, best_labels)
+            best_distances = np.where(better[:, None, None], distances, best_distances)
+            best_inertia = np.where(better, inertia, best_inertia)
+    return best_labels, np.sqrt(best_distances.min(axis=2))
+
+#Function to get the mean silhouette score of each product, like metrics.silhouette_score
+def batchSilhouette(X, labels, n_clusters):
+    pairwise = np.sqrt(squaredDistances(X, X))
+    onehot = (labels[:, :, None] == np.arange(n_clusters)).astype(X.dtype)
+    counts = onehot.sum(axis=1)
+    #Sum of the distances from every point to the points of each cluster, (products, countries, clusters)
+    sums = np.matmul(pairwise, onehot)
+    own_counts = np.take_along_axis(counts, labels, axis=1)
+    a = np.take_along_axis(sums, labels[:, :, None], axis=2)[:, :, 0] / np.maximum(own_counts - 1, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_other = sums / counts[:, None, :]
+    #The own cluster and the empty clusters are not candidates for the nearest other cluster
+    mean_other[onehot.astype(bool) | (counts[:, None, :] == 0)] = np.inf
+    b = mean_other.min(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sil_samples = np.nan_to_num((b - a) / np.maximum(a, b))
+    #Points alone in their cluster have a silhouette of 0
+    sil_samples[own_counts <= 1] = 0
+    sil_scores = sil_samples.mean(axis=1)
+    #The score is not defined when a product ends with a single cluster
+    sil_scores[(counts > 0).sum(axis=1) < 2] = np.nan
+    return sil_scores
+
+#Function to get the clusterization results of many products, processing them in chunks to limit the memory used
+def batchClusterModels(productos, radar_v, n_clusters, chunk_size=128):
+    labels, distances, sil_scores = [], [], []
+    for start in range(0, len(productos), chunk_size):
+        X, df_countries = getBatchFeatures(productos[start:start + chunk_size], radar_v)
+        chunk_labels, chunk_distances = batchKMeans(X, n_clusters)
+        labels.append(chunk_labels)
+        distances.append(chunk_distances)
+        sil_scores.append(batchSilhouette(X, chunk_labels, n_clusters))
+    return np.vstack(labels), np.vstack(distances), np.concatenate(sil_scores), df_countries
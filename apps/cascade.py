@@ -0,0 +1,33 @@
+import functools
+from dash import dcc
+from apps import data
+
+#----------------------------------------------------------------------------
+# This module serializes the sector -> subsector -> product hierarchy once, so the dropdowns of the radar and model pages
+# are filled in the browser by clientside callbacks (See assets/cascade.js) instead of a request to the server.
+# The hierarchy has the sorted product labels, the sorted subsectors of each sector and the positions of the
+# labels of each subsector in the product list, which keeps the JSON small.
+
+#Function to build the hierarchy from the product relationships dataframe and the labels of the products
+def getHierarchy(df_relaciones, labels):
+    df_relaciones = df_relaciones.assign(label_productos=df_relaciones["producto"].map(labels))
+    productos = sorted(df_relaciones["label_productos"])
+    posiciones = {}
+    for idx, label in enumerate(productos):
+        posiciones.setdefault(label, []).append(idx)
+    sectores = {sector: sorted(dff["subsector"].unique()) for sector, dff in df_relaciones.groupby("sector", observed=True)}
+    subsectores = {}
+    for subsector, dff in df_relaciones.groupby("subsector", observed=True):
+        #Each label takes its positions in order, so repeated labels are not counted twice
+        usados = {}
+        idx_labels = []
+        for label in dff["label_productos"]:
+            idx_labels.append(posiciones[label][usados.get(label, 0)])
+            usados[label] = usados.get(label, 0) + 1
+        subsectores[subsector] = sorted(idx_labels)
+    return {"productos": productos, "sectores": sectores, "subsectores": subsectores}
+
+#Store included once in the main layout, shared by the pages. It is built the first time the app is loaded, or in the warmup
+@functools.lru_cache(maxsize=None)
+def getStore():
+    return dcc.Store(id="jerarquia-productos", data=getHierarchy(data.df_relaciones_productos, data.product_labels))
@@ -2,79 +2,125 @@ import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-from sklearn import preprocessing
-import pathlib
+import functools
+import os
+from apps import data
+from apps import cluster_store
+from apps import score_engine
 
 #---------------------------------------------------------------
-# Loading Data
-PATH = pathlib.Path(__file__).parent
-DATA_PATH = PATH.joinpath("../data").resolve()
-
-# Loading product-level Data
-df_productos = pd.read_csv(DATA_PATH.joinpath('df_productos.csv'),dtype={'producto': str})
-#Loading country level data
-df_paises = pd.read_csv(DATA_PATH.joinpath("df_indices_paises.csv"),sep=";")
-rename_cat={'iso3':"iso3", 'nombre':"Nombre_pais",'epi':"Sostenibilidad/EPI", 
-            'innovacion':"Innovación", 'competitividad':"Competitividad",'distancia':"Distancia"}
-df_paises.rename(columns=rename_cat, inplace=True)
+#How the silhouette score of the models is calculated: "exact" uses all the countries, "sampled" a random sample of them
+#with a fixed seed and "cached" keeps the exact score of each (product, radar version, number of clusters)
+SILHOUETTE_MODE = os.environ.get("CLUSTER_SILHOUETTE_MODE", "exact")
+SILHOUETTE_SAMPLE_SIZE = int(os.environ.get("CLUSTER_SILHOUETTE_SAMPLE_SIZE", "1000"))
+SILHOUETTE_CACHE_SIZE = 4096
+_silhouette_cache = {}
 
 #----------------------------------------------------------------------------
 # This module has all the functions to perform the Clusterización - Kmeans algorithm
 
+#Function to import scikit-learn. It takes more than a second, so it is done the first time a model is needed, or in the warmup (See index.py)
+def loadSklearn():
+    global KMeans, silhouette_score, preprocessing, BallTree
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+    from sklearn import preprocessing
+    from sklearn.neighbors import BallTree
+
 #Function to prepare the data by transforming and scaling the indexes
 def prepareData(df):
+    loadSklearn()
     #Scaling the column values to avoid one column from influencing the results over the rest
     min_max_scaler = preprocessing.MinMaxScaler()
     x_minmax = min_max_scaler.fit_transform(df)
     feature_names = df.columns
     return pd.DataFrame(x_minmax, columns=feature_names)
 
+#Function to get the silhouette score of a model with the given mode. Returns the score and the mode that actually produced it
+def scoreClusters(df_norm, cluster_labels, scoring=None, cache_key=None):
+    loadSklearn()
+    scoring = scoring or SILHOUETTE_MODE
+    if scoring == "sampled" and len(df_norm.index) > SILHOUETTE_SAMPLE_SIZE:
+        return silhouette_score(df_norm, cluster_labels, sample_size=SILHOUETTE_SAMPLE_SIZE, random_state=7), "sampled"
+    if scoring == "cached" and cache_key is not None:
+        #The models are fitted with a fixed random state, so the score of a key doesn't change while the data is the same
+        if cache_key in _silhouette_cache:
+            return _silhouette_cache[cache_key], "cached"
+        if len(_silhouette_cache) >= SILHOUETTE_CACHE_SIZE:
+            _silhouette_cache.pop(next(iter(_silhouette_cache)))
+        _silhouette_cache[cache_key] = silhouette_score(df_norm, cluster_labels)
+        return _silhouette_cache[cache_key], "exact"
+    return silhouette_score(df_norm, cluster_labels), "exact"
+
 #Function to do the clusterization and calculating results
-def doClusters(df_norm, df_total, n_clusters = 12):
-    #Fitting the model on the normalized variables
+def doClusters(df_norm, df_total, n_clusters = 12, scoring = None, cache_key = None):
+    loadSklearn()
+    #Fitting the model on the normalized variables. A single fit gives both the labels and the distances to the centroids
     kmeans = KMeans(n_clusters=n_clusters, random_state=7)
     cluster_res = kmeans.fit(df_norm)
-    cluster_labels = kmeans.fit_predict(df_norm)
-    sil_sc = silhouette_score(df_norm, cluster_labels)
+    cluster_labels = cluster_res.labels_
+    sil_sc, sil_mode = scoreClusters(df_norm, cluster_labels, scoring, cache_key)
     #Getting cluster labels and distances
-    df_labels = pd.DataFrame(cluster_res.predict(df_norm),columns=["cluster"],index=df_total.index)
+    df_labels = pd.DataFrame(cluster_labels,columns=["cluster"],index=df_total.index)
     distances = pd.DataFrame(cluster_res.transform(df_norm),index=df_total.index).min(axis=1)
+    df_clusterizado, num_pais_cluster = joinClusters(df_total, df_labels, distances)
+    return df_clusterizado, num_pais_cluster, sil_sc, sil_mode
+
+#Function to add the cluster labels and the distances to the centroids to the countries dataframe
+def joinClusters(df_total, df_labels, distances):
     #Returning dataframe with labels and distances to centroids
     df_clusterizado = df_total.join(df_labels)
     df_clusterizado["d_centroides"] = distances
     #Returning a list of countries per cluster in case it is needed
     num_pais_cluster = df_clusterizado.groupby("cluster")["iso3"].count()
-    return df_clusterizado, num_pais_cluster, sil_sc
+    return df_clusterizado, num_pais_cluster
 
-#General function to prepare data and do clusterization model
-def getClusterModel(producto, radar_v, n_clusters = 8):
+#Function to get the countries dataframe with the indexes used by the clusterization model, which are the same for every product
+def getCountryData(radar_v):
     #Selecting the columns and dataframe to do the clusterization
     if radar_v == "Competitividad":
-        df = df_paises[["iso3","Nombre_pais","Region","Sostenibilidad/EPI","Innovación","Competitividad","Distancia"]].copy()
+        df = data.df_paises[["iso3","Nombre_pais","Region","Sostenibilidad/EPI","Innovación","Competitividad","Distancia"]].copy()
         columns = ["Sostenibilidad/EPI", "Innovación","Competitividad","Distancia","Arancel","Demanda"]
     else:
-        df = df_paises[["iso3","Nombre_pais","Region","Sostenibilidad","Desarrollo","Oportunidad"]].copy()
+        df = data.df_paises[["iso3","Nombre_pais","Region","Sostenibilidad","Desarrollo","Oportunidad"]].copy()
         columns = ["Sostenibilidad", "Desarrollo","Oportunidad","Arancel","Demanda"]
     #Colombia gets deleted before making the model
     df_copy = df.loc[(df["iso3"] != "COL")].copy()
-    #Getting tariff and demand scores based on the product selected
-    dff_prod = df_productos.loc[(df_productos["producto"] == producto),["iso3","Demanda","Arancel"]]
-    #Joining those scores to the country indexes
-    df_joined = pd.merge(df_copy, dff_prod, on='iso3', how='left')
+    return df_copy.reset_index(drop=True), columns
+
+#Function to get the countries dataframe with the indexes and scores used by the clusterization model for a given product
+def getClusterData(producto, radar_v):
+    #Getting tariff and demand scores based on the product selected and joining them to the country indexes
+    df_joined, columns = getCountryData(radar_v)
+    df_joined[["Demanda","Arancel"]] = score_engine.getScores("producto", [producto], df_joined["iso3"])[0]
     df_joined.fillna(0,inplace=True)
     df_joined.set_index('iso3')
+    return df_joined, columns
+
+#General function to prepare data and do clusterization model. Also returns how the silhouette score was obtained:
+#"stored" when read from the cluster store, otherwise the mode returned by scoreClusters
+def getClusterModel(producto, radar_v, n_clusters = 8):
+    df_joined, columns = getClusterData(producto, radar_v)
+    #The results are read from the precomputed cluster store when it has them (See cluster_store.py)
+    stored = cluster_store.getStoredModel(producto, radar_v, n_clusters, df_joined["iso3"])
+    if stored is not None:
+        labels, distances, sil_sc = stored
+        df_labels = pd.DataFrame(labels,columns=["cluster"],index=df_joined.index)
+        df_modelo, _ = joinClusters(df_joined, df_labels, pd.Series(distances,index=df_joined.index))
+        return df_modelo, sil_sc, "stored"
     #Normalizing the data
     df_norm = prepareData(df_joined[columns])
     #Fitting the clustering model
-    df_modelo, _, sil_sc = doClusters(df_norm, df_joined, n_clusters)
-    return df_modelo, sil_sc
+    df_modelo, _, sil_sc, sil_mode = doClusters(df_norm, df_joined, n_clusters, cache_key=(producto, radar_v, n_clusters))
+    return df_modelo, sil_sc, sil_mode
 
-#Function to get the four closest countries according to the results of a clusterization model
-def getRecommendedCountries(producto, country, radar_v):
+#Function to get the k closest countries (four by default) according to the results of a clusterization model.
+#With mode="neighbors" it returns instead the k most similar countries according to the given metric, without fitting a model
+def getRecommendedCountries(producto, country, radar_v, mode="cluster", k=4, metric="euclidean"):
+    if mode == "neighbors":
+        return getNearestCountries(producto, country, radar_v, k, metric)
     #Get dataframe with cluster results, labels and distances
-    df_clusterizado, _ = getClusterModel(producto, radar_v)
+    df_clusterizado, _, _ = getClusterModel(producto, radar_v)
     #Get the searched country cluster label
     country_cluster_num = df_clusterizado.loc[df_clusterizado["iso3"]==country,"cluster"].iloc[0]
     #Selecting only the cluster to which the country belongs and sorting by distance
@@ -92,10 +138,37 @@ def getRecommendedCountries(producto, country, radar_v):
         indexes = [idx_country-1,idx_country-2,idx_country-3,idx_country-4]
     else:
         indexes = [idx_country-1,idx_country-2,idx_country+1,idx_country+2]
-    #Returning only the four recommended countries
+    #Small clusters may not have enough countries after the searched one, then the four closest by position are taken
+    if max(indexes, default=0) >= num_countries_in_cluster:
+        indexes = sorted([idx for idx in range(num_countries_in_cluster) if idx != idx_country], key=lambda idx: abs(idx - idx_country))[:4]
+    #Other values of k cut the four countries or add the next closest members of the cluster by position
+    if k > len(indexes):
+        taken = {idx % num_countries_in_cluster for idx in indexes}
+        indexes += sorted([idx for idx in range(num_countries_in_cluster) if idx != idx_country and idx not in taken], key=lambda idx: abs(idx - idx_country))
+    indexes = indexes[:k]
+    #Returning only the recommended countries
     paises_recomendados = df_sorted.iloc[indexes]["Nombre_pais"].tolist()
     return paises_recomendados
 
+#Function to build a BallTree over the normalized indexes and scores of the countries for a product.
+#The trees of the last products used are kept in memory, so most recommendations are only a query
+@functools.lru_cache(maxsize=256)
+def getNeighborsTree(producto, radar_v, metric="euclidean"):
+    loadSklearn()
+    df_joined, columns = getClusterData(producto, radar_v)
+    x_norm = prepareData(df_joined[columns]).to_numpy()
+    return BallTree(x_norm, metric=metric), x_norm, df_joined["iso3"].tolist(), df_joined["Nombre_pais"].tolist()
+
+#Function to get the k most similar countries to a given country for a product, using the same features as the clusterization model
+def getNearestCountries(producto, country, radar_v, k=4, metric="euclidean"):
+    tree, x_norm, iso3_list, nombres = getNeighborsTree(producto, radar_v, metric)
+    if country not in iso3_list:
+        return []
+    idx_country = iso3_list.index(country)
+    #The closest point is the country itself, so one more neighbor is asked for
+    _, neighbors = tree.query(x_norm[idx_country:idx_country+1], k=min(k+1, len(iso3_list)))
+    return [nombres[idx] for idx in neighbors[0] if idx != idx_country][:k]
+
 #Function to make the sankey diagram according to a dataframe with the clusterization results
 def getSankey(df_clusterizado):
     #Make a sankey diagram grouping the clusterization results by region
@@ -0,0 +1,105 @@
+import numpy as np
+import sys
+import threading
+import time
+from apps import data
+from apps import cluster
+from apps import batch_cluster
+
+#---------------------------------------------------------------
+# Store location
+STORE_PATH = data.DATA_PATH.joinpath("cluster_store.npz")
+#The store is only valid for the exact data files it was built from (their columnar versions when they are loaded from them)
+SOURCE_FILES = ["df_productos.csv", "df_indices_paises.csv"]
+
+#Radar versions and number of clusters used by the app: 8 for the radar recommendations and 10 for the model page
+RADAR_VERSIONS = ["Competitividad", "Oportunidad"]
+CLUSTER_COUNTS = [8, 10]
+
+#----------------------------------------------------------------------------
+# This module precomputes the k-means results of every product so the callbacks don't have to fit a model on each request.
+# To build (or rebuild after the data changes) the store, run from the repository root:
+#   python -m apps.cluster_store
+# With --batch, the models of all the products are fitted together with batch_cluster.py, which is much faster
+# but doesn't give exactly the same labels as fitting each product with scikit-learn:
+#   python -m apps.cluster_store --batch
+
+#Function to get the name of an array in the store
+def storeKey(radar_v, n_clusters, name):
+    return f"{radar_v}_{n_clusters}_{name}"
+
+#Function to fit the clusterization model for every product and radar version and save the results to disk
+def buildStore(path=STORE_PATH, productos=None, batch=False):
+    if productos is None:
+        productos = sorted(data.df_productos["producto"].unique())
+    arrays = {"productos": np.array(productos), "fingerprint": np.array(data.dataFingerprint(SOURCE_FILES))}
+    start = time.time()
+    for radar_v in RADAR_VERSIONS:
+        for n_clusters in CLUSTER_COUNTS:
+            if batch:
+                labels, distances, sil_scores, df_countries = batch_cluster.batchClusterModels(productos, radar_v, n_clusters)
+                arrays["iso3"] = df_countries["iso3"].to_numpy().astype(str)
+                arrays[storeKey(radar_v, n_clusters, "labels")] = labels.astype(np.int8)
+                arrays[storeKey(radar_v, n_clusters, "distances")] = distances.astype(np.float32)
+                arrays[storeKey(radar_v, n_clusters, "silhouette")] = sil_scores.astype(np.float32)
+                print(f"{radar_v} k={n_clusters}: {len(productos)} productos ({time.time() - start:.0f}s)")
+                continue
+            labels, distances, sil_scores = [], [], []
+            for idx, producto in enumerate(productos):
+                #Same steps as cluster.getClusterModel, always fitting the model
+                df_joined, columns = cluster.getClusterData(producto, radar_v)
+                df_norm = cluster.prepareData(df_joined[columns])
+                df_modelo, _, sil_sc, _ = cluster.doClusters(df_norm, df_joined, n_clusters, scoring="exact")
+                labels.append(df_modelo["cluster"].to_numpy(dtype=np.int8))
+                distances.append(df_modelo["d_centroides"].to_numpy(dtype=np.float32))
+                sil_scores.append(sil_sc)
+                if (idx + 1) % 500 == 0:
+                    print(f"{radar_v} k={n_clusters}: {idx + 1}/{len(productos)} productos ({time.time() - start:.0f}s)")
+            #The countries are the same for every product, so they are saved only once per radar version
+            arrays["iso3"] = df_joined["iso3"].to_numpy().astype(str)
+            arrays[storeKey(radar_v, n_clusters, "labels")] = np.vstack(labels)
+            arrays[storeKey(radar_v, n_clusters, "distances")] = np.vstack(distances)
+            arrays[storeKey(radar_v, n_clusters, "silhouette")] = np.array(sil_scores, dtype=np.float32)
+    np.savez_compressed(path, **arrays)
+    print(f"Cluster store with {len(productos)} productos saved to {path} ({time.time() - start:.0f}s)")
+
+#----------------------------------------------------------------------------
+# Reading the store
+_store = None
+_productos_idx = None
+_loaded = False
+_lock = threading.Lock()
+
+#Function to load the store once. Returns None if it does not exist or if it was built from different data
+def loadStore(path=STORE_PATH):
+    global _store, _productos_idx, _loaded
+    with _lock:
+        if not _loaded:
+            if path.exists():
+                with np.load(path) as npz:
+                    store = {key: npz[key] for key in npz.files}
+                if str(store["fingerprint"]) == data.dataFingerprint(SOURCE_FILES):
+                    _productos_idx = {producto: idx for idx, producto in enumerate(store["productos"].tolist())}
+                    _store = store
+                else:
+                    print(f"Cluster store {path} is outdated, the models will be fitted on each request")
+            _loaded = True
+    return _store
+
+#Function to get the stored labels, distances to centroids and silhouette score of a product. Returns None if not available
+def getStoredModel(producto, radar_v, n_clusters, iso3):
+    store = loadStore()
+    if store is None or producto not in _productos_idx:
+        return None
+    key = storeKey(radar_v, n_clusters, "labels")
+    #The stored results are only used if the countries are the same and in the same order
+    if key not in store or not np.array_equal(store["iso3"], np.asarray(iso3).astype(str)):
+        return None
+    idx = _productos_idx[producto]
+    labels = store[key][idx].astype(np.int32)
+    distances = store[storeKey(radar_v, n_clusters, "distances")][idx].astype(np.float64)
+    sil_sc = float(store[storeKey(radar_v, n_clusters, "silhouette")][idx])
+    return labels, distances, sil_sc
+
+if __name__ == '__main__':
+    buildStore(batch="--batch" in sys.argv)
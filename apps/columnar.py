@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import json
+import pathlib
+import shutil
+import sys
+
+#----------------------------------------------------------------------------
+# This module saves and loads dataframes in a simple columnar binary format: one .npy file per column plus a schema.json file.
+# Numeric columns are saved as they are and text columns as integer codes plus the list of their unique values.
+# When loading, the numeric columns are memory-mapped instead of parsed, so the workers of the app share their pages.
+# The data files of the app can be converted from CSV running from the repository root:
+#   python -m apps.columnar data
+
+SCHEMA_FILE = "schema.json"
+COLUMNAR_FOLDER = "columnar"
+
+#Function to get the folder of the columnar version of a CSV file, e.g. data/df_productos.csv -> data/columnar/df_productos
+def columnarPath(csv_path):
+    csv_path = pathlib.Path(csv_path)
+    return csv_path.parent.joinpath(COLUMNAR_FOLDER, csv_path.stem)
+
+#Function to save a dataframe to a folder in columnar format
+def writeColumnar(df, path):
+    #The files are written to a temporary folder that replaces the old one at the end. The running workers keep
+    #their memory maps of the old files, which are only deleted from the folder, and never read a half written dataset
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    columns = []
+    for idx, column in enumerate(df.columns):
+        #The files are named by position because the column names have characters like "/"
+        file_name = f"col_{idx:03d}.npy"
+        values = df[column]
+        if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype):
+            codes, categories = pd.factorize(values)
+            np.save(tmp_path.joinpath(file_name), codes.astype(np.int32))
+            columns.append({"name": column, "file": file_name, "kind": "text", "categories": categories.tolist()})
+        else:
+            np.save(tmp_path.joinpath(file_name), values.to_numpy())
+            columns.append({"name": column, "file": file_name, "kind": "numeric"})
+    with open(tmp_path.joinpath(SCHEMA_FILE), "w", encoding="utf-8") as f:
+        json.dump({"rows": len(df.index), "columns": columns}, f, ensure_ascii=False)
+    shutil.rmtree(path, ignore_errors=True)
+    tmp_path.rename(path)
+
+#Function to load a dataframe saved with writeColumnar. The numeric columns are read-only memory maps of the files.
+#With categorical=True the text columns are categoricals over the memory-mapped codes, instead of arrays of strings
+def readColumnar(path, categorical=False):
+    path = pathlib.Path(path)
+    with open(path.joinpath(SCHEMA_FILE), encoding="utf-8") as f:
+        schema = json.load(f)
+    columns = {}
+    for column in schema["columns"]:
+        values = np.asarray(np.load(path.joinpath(column["file"]), mmap_mode="r"))
+        if column["kind"] == "text" and categorical:
+            values = pd.Categorical.from_codes(values, column["categories"])
+        elif column["kind"] == "text":
+            #The missing values have the code -1, which takes the extra NaN added at the end of the categories
+            categories = np.array(column["categories"] + [np.nan], dtype=object)
+            values = categories[values]
+        columns[column["name"]] = values
+    #copy=False keeps every column in its own block, pointing to the memory-mapped file
+    return pd.DataFrame(columns, copy=False)
+
+#Function to know if a CSV file has an up to date columnar version
+def hasColumnar(csv_path):
+    schema_path = columnarPath(csv_path).joinpath(SCHEMA_FILE)
+    if not schema_path.exists():
+        return False
+    csv_path = pathlib.Path(csv_path)
+    return not csv_path.exists() or csv_path.stat().st_mtime <= schema_path.stat().st_mtime
+
+#Function to load a data file, from its columnar version when it is up to date and parsing the CSV otherwise
+def readDataset(csv_path, categorical=False, **read_csv_args):
+    if hasColumnar(csv_path):
+        return readColumnar(columnarPath(csv_path), categorical)
+    return pd.read_csv(csv_path, **read_csv_args)
+
+#Data files of the app and the options to parse them
+DATASETS = {
+    "df_indices_paises.csv": {"sep": ";"},
+    "df_idx_var.csv": {"sep": ";"},
+    "df_sectores.csv": {"sep": ","},
+    "df_subsectores.csv": {"sep": ","},
+    "df_productos.csv": {"dtype": {"producto": str}},
+    "relaciones_productos.csv": {"sep": ";", "dtype": {"producto": str}},
+}
+
+#Function to convert all the CSV data files in a folder to the columnar format
+def convertFolder(data_path):
+    data_path = pathlib.Path(data_path)
+    for file_name, read_csv_args in DATASETS.items():
+        csv_path = data_path.joinpath(file_name)
+        if csv_path.exists():
+            writeColumnar(pd.read_csv(csv_path, **read_csv_args), columnarPath(csv_path))
+            print(f"{csv_path} -> {columnarPath(csv_path)}")
+
+if __name__ == '__main__':
+    convertFolder(sys.argv[1] if len(sys.argv) > 1 else "data")
@@ -0,0 +1,91 @@
+import numpy as np
+import os
+import pandas as pd
+import threading
+from apps import data
+from apps import ranking
+from apps import score_engine
+
+#---------------------------------------------------------------
+#Number of best items of each country kept in the index. Longer rankings, or rankings with other weights, are computed when asked
+INDEX_TOP = int(os.environ.get("COUNTRY_INDEX_TOP", "100"))
+#Scores of the items for a country, and the precomputed rankings with the weight of each score
+SCORES = ["Demanda", "Arancel"]
+RANKINGS = {"Puntaje": {"Demanda": 1.0, "Arancel": 1.0}, "Demanda": {"Demanda": 1.0}, "Arancel": {"Arancel": 1.0}}
+
+#----------------------------------------------------------------------------
+# This module is the reverse of the score arrays: for each destination country, the products, subsectors and sectors with
+# the best scores. The top INDEX_TOP items of every country are ranked once, for every level and ranking, when the index is
+# loaded (In the warmup of index.py or on first use), so a query only reads a row of the index.
+# Only the items with data for the country are ranked.
+
+_index = {}
+_lock = threading.Lock()
+_loaded = False
+
+#Function to get the weighted score of the items for the countries, from scores of shape (items, countries, SCORES).
+#The items without data get -inf, so they are never ranked
+def weightedScore(scores, present, weights):
+    unknown = sorted(set(weights) - set(SCORES))
+    if unknown:
+        raise ValueError(f"The scores {unknown} can't be weighted, only {SCORES}")
+    values = np.array([float(weights.get(score, 0.0)) for score in SCORES])
+    if (values < 0).any() or values.sum() <= 0:
+        raise ValueError("The weights can't be negative or all 0")
+    combined = np.nan_to_num(scores) @ (values / values.sum())
+    combined[~present] = -np.inf
+    return combined
+
+#Function to rank the best items of every country, for every level and ranking
+def buildIndex():
+    countries = score_engine.getCountries()
+    for level in score_engine.LEVELS:
+        items = score_engine.getItems(level)
+        scores = score_engine.getScores(level, items, countries, SCORES)
+        present = score_engine.getPresent(level, items, countries)
+        n_present = present.sum(axis=0)
+        for name, weights in RANKINGS.items():
+            #The rows are the countries and the columns their best item codes, from the best
+            top = ranking.topIndices(weightedScore(scores, present, weights).T, INDEX_TOP).astype(np.int32)
+            #The positions beyond the items with data of each country are marked with -1
+            top[np.arange(top.shape[1])[np.newaxis, :] >= n_present[:, np.newaxis]] = -1
+            _index[(level, name)] = top
+
+#Function to build the index the first time it is needed
+def loadIndex():
+    global _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                buildIndex()
+                _loaded = True
+
+#Function to get the k best items of a level for a country (iso3), by one of the RANKINGS or by custom weights of the SCORES.
+#Returns a dataframe with the ranking, the item, its label for the products, and its scores
+def topItems(level, country, k=10, by="Puntaje", weights=None):
+    if level not in score_engine.LEVELS:
+        raise ValueError(f"The level must be one of {score_engine.LEVELS}")
+    if weights is None and by not in RANKINGS:
+        raise ValueError(f"The ranking must be one of {list(RANKINGS)}")
+    loadIndex()
+    idx_country = score_engine.iso3Codes([country])[0]
+    if idx_country < 0:
+        raise ValueError(f"Unknown country: {country}")
+    items = score_engine.getItems(level)
+    if weights is None and k <= INDEX_TOP:
+        idx_items = _index[(level, by)][idx_country, :k]
+    else:
+        #Rankings that are not in the index only need the scores of this country
+        scores = score_engine.getScores(level, items, [country], SCORES)
+        present = score_engine.getPresent(level, items, [country])
+        combined = weightedScore(scores, present, RANKINGS[by] if weights is None else weights)[:, 0]
+        idx_items = ranking.topIndices(combined[np.newaxis, :], k)[0]
+        idx_items = idx_items[np.isfinite(combined[idx_items])]
+    idx_items = idx_items[idx_items >= 0]
+    selected = [items[idx] for idx in idx_items]
+    scores = score_engine.getScores(level, selected, [country], SCORES)[:, 0]
+    dff = pd.DataFrame({"Ranking": np.arange(1, len(selected) + 1), level: pd.Series(selected, dtype=object)})
+    if level == "producto":
+        dff["label_productos"] = dff["producto"].map(data.product_labels)
+    dff[SCORES] = scores
+    return dff
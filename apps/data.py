@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import hashlib
+import os
+import pathlib
+import sys
+import threading
+from apps import columnar
+
+#---------------------------------------------------------------
+# Data folder. It can be changed with the RADAR_DATA_PATH environment variable, e.g. to run the benchmarks on synthetic data
+PATH = pathlib.Path(__file__).parent
+DATA_PATH = pathlib.Path(os.environ.get("RADAR_DATA_PATH", PATH.joinpath("../data"))).resolve()
+#With RADAR_COMPACT=1 the score frames are loaded with compact dtypes: categorical codes for the text columns and float32 for the
+#scores, which also makes the score arrays of score_engine.py float32. Run "python -m apps.data" to see the memory of each frame
+COMPACT = os.environ.get("RADAR_COMPACT", "0") == "1"
+#Score columns of the frames of each level
+SCORE_COLUMNS = ["Oferta", "Demanda", "Arancel"]
+#The scores of the data files have at most 3 decimals (See data_cleaning_demand_tariff.py), so rounding a float32 score
+#to 6 decimals gives back exactly the float64 value of the file
+SCORE_DECIMALS = 6
+
+#----------------------------------------------------------------------------
+# This module is the only place where the data files are loaded. Each dataset is read, typed and renamed once per process,
+# the first time it is used, and every page module uses these same dataframes. When the app runs with gunicorn --preload and
+# the warmup of index.py loads the data, it is loaded in the master process and the forked workers share its memory pages.
+# The dataframes are shared and read-only: use .copy() before modifying any of them.
+# Each file is loaded from its columnar binary version (See columnar.py) when it is up to date, and parsed from the CSV otherwise.
+
+#Function to load one of the data files of the app. With categorical=True the text columns are categoricals
+def loadDataset(file_name, categorical=False):
+    return columnar.readDataset(DATA_PATH.joinpath(file_name), categorical=categorical, **columnar.DATASETS[file_name])
+
+#Function to make the given text columns of a dataframe categorical and its given float columns float32
+def compactFrame(df, text_columns, float_columns=()):
+    for column in text_columns:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    for column in float_columns:
+        df[column] = df[column].astype(np.float32)
+    return df
+
+#Function to make the numeric data of a shared dataframe read-only, so a callback can't modify the scores by mistake.
+#The text columns are left as they are because pandas needs them writable for its comparisons. The values of a column
+#are a view of the array that pandas keeps for all the columns of its type, so that array is made read-only too
+def freeze(df):
+    for column in df.select_dtypes("number").columns:
+        values = df[column].to_numpy()
+        while isinstance(values, np.ndarray):
+            values.flags.writeable = False
+            values = values.base
+    return df
+
+#Function to get a fingerprint of the content of the given data files, used to know when the data changes.
+#The columnar version of a file is hashed instead of the CSV when it is the one loaded, so the fingerprint also works
+#where only the columnar files are deployed
+def dataFingerprint(file_names):
+    md5 = hashlib.md5()
+    for file_name in file_names:
+        csv_path = DATA_PATH.joinpath(file_name)
+        paths = [csv_path]
+        if columnar.hasColumnar(csv_path):
+            paths = sorted(columnar.columnarPath(csv_path).iterdir())
+        for path in paths:
+            md5.update(path.name.encode())
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    md5.update(chunk)
+    return md5.hexdigest()
+
+#Function to get an identifier of the current version of the data files, based on their size and modification time.
+#The caches of results use it in their keys, so they never serve results computed from other data
+def dataVersion():
+    md5 = hashlib.md5()
+    for file_name in columnar.DATASETS:
+        csv_path = DATA_PATH.joinpath(file_name)
+        for path in [csv_path, columnar.columnarPath(csv_path).joinpath(columnar.SCHEMA_FILE)]:
+            if path.exists():
+                stat = path.stat()
+                md5.update(f"{path.relative_to(DATA_PATH)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return md5.hexdigest()[:16]
+
+#Version of the data loaded by this process
+DATA_VERSION = dataVersion()
+
+#Names of the shared dataframes. They are loaded all together the first time one of them is used (data.df_paises...),
+#or when loadData is called, e.g. in the warmup of index.py
+FRAMES = ["df_paises", "df_idx_var", "df_sectores", "df_subsectores", "df_productos", "df_relaciones_productos", "product_labels"]
+_lock = threading.Lock()
+
+#Function to load all the shared dataframes once
+def loadData():
+    with _lock:
+        if "df_paises" in globals():
+            return
+        #Country level data
+        df_paises = loadDataset("df_indices_paises.csv")
+        rename_cat={'iso3':"iso3", 'nombre':"Nombre_pais",'epi':"Sostenibilidad/EPI",
+                    'innovacion':"Innovación", 'competitividad':"Competitividad",'distancia':"Distancia"}
+        df_paises.rename(columns=rename_cat, inplace=True)
+        df_idx_var = loadDataset("df_idx_var.csv")
+
+        #Product level data (Including sector and subsectors)
+        df_sectores = loadDataset("df_sectores.csv", COMPACT)
+        df_subsectores = loadDataset("df_subsectores.csv", COMPACT)
+        df_productos = loadDataset("df_productos.csv", COMPACT)
+        df_relaciones_productos = loadDataset("relaciones_productos.csv")
+        if COMPACT:
+            for dff, level in [(df_sectores, "sector"), (df_subsectores, "subsector"), (df_productos, "producto")]:
+                compactFrame(dff, ["iso3", level], SCORE_COLUMNS)
+            compactFrame(df_relaciones_productos, ["sector", "subsector"])
+        #Label of each product for the dropdowns and the graphs, kept once per product as an interned string
+        df_labels = df_relaciones_productos.drop_duplicates("producto")
+        product_labels = pd.Series([sys.intern(f"{producto}-{desc}") for producto, desc in zip(df_labels["producto"], df_labels["desc_producto"])],
+                                   index=df_labels["producto"].to_numpy(), dtype=object)
+
+        for dff in [df_paises, df_idx_var, df_sectores, df_subsectores, df_productos, df_relaciones_productos]:
+            freeze(dff)
+        #df_paises is set last, so the other threads only see the data when all of it is loaded
+        globals().update(df_idx_var=df_idx_var, df_sectores=df_sectores, df_subsectores=df_subsectores,
+                         df_productos=df_productos, df_relaciones_productos=df_relaciones_productos, product_labels=product_labels)
+        globals()["df_paises"] = df_paises
+
+#The dataframes are module attributes that are loaded on first access
+def __getattr__(name):
+    if name in FRAMES:
+        loadData()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+#Function to get the memory used by each shared dataframe, in bytes
+def memoryReport():
+    loadData()
+    return {name: int(globals()[name].memory_usage(deep=True).sum()) if name != "product_labels" else int(product_labels.memory_usage(deep=True))
+            for name in FRAMES}
+
+if __name__ == '__main__':
+    from apps import score_engine
+    import resource
+    score_engine.loadEngine()
+    report = memoryReport()
+    report["score_engine arrays"] = score_engine.memoryUsage()
+    print(f"Memory with RADAR_COMPACT={int(COMPACT)}:")
+    for name, size in report.items():
+        print(f"    {name:<24} {size / 1024 ** 2:>9.2f} MB")
+    print(f"    {'total':<24} {sum(report.values()) / 1024 ** 2:>9.2f} MB")
+    #Resident memory now (Linux only) and at its peak, which includes the parsing of the files. ru_maxrss is in KB on Linux
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as f:
+            print(f"    {'RSS of the process':<24} {int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2:>9.2f} MB")
+    print(f"    {'max RSS of the process':<24} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:>9.2f} MB")
@@ -0,0 +1,112 @@
+import flask
+import io
+import numpy as np
+import os
+import pandas as pd
+from apps import data
+from apps import score_engine
+
+#---------------------------------------------------------------
+# Export configuration
+#Approximate number of rows written at a time, which bounds the memory used by an export
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "100000"))
+#Country indexes of each radar version, as in radar_df.py
+VERSION_COLUMNS = {"Competitividad": ["Sostenibilidad/EPI", "Innovación", "Competitividad", "Distancia"],
+                   "Oportunidad": ["Sostenibilidad", "Desarrollo", "Oportunidad"]}
+
+#----------------------------------------------------------------------------
+# This module exports the full radar matrix of a level (every product, sector or subsector with every country) on
+#   /api/export/<producto|sector|subsector>?format=csv|parquet&version=Competitividad|Oportunidad&comercial=UE,CAN
+# Each row has the country indexes of the radar versions (Both unless one is asked for) and the demand and tariff scores
+# of the pair, filled with 0 where there is no data like in the radar. The countries can be filtered by their trade agreement.
+# The file is built and sent in chunks of items, so the memory used doesn't depend on the size of the matrix.
+# Parquet needs pyarrow, which is optional.
+
+#File-like object that keeps what pyarrow writes until it is sent, so the Parquet file can be streamed
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, chunk):
+        self.parts.append(bytes(chunk))
+        self.position += len(chunk)
+        return len(chunk)
+
+    def tell(self):
+        return self.position
+
+    #Function to get what was written since the last call
+    def take(self):
+        chunk = b"".join(self.parts)
+        self.parts = []
+        return chunk
+
+#Function to get the countries of the export and their columns, filtered by trade agreement
+def getCountries(versions, agreements=None):
+    columns = ["iso3", "Nombre_pais", "Region", "comercial"] + [column for version in versions for column in VERSION_COLUMNS[version]]
+    df = data.df_paises
+    if agreements:
+        df = df[df["comercial"].isin(agreements)]
+    return df[columns].reset_index(drop=True)
+
+#Generator of the chunks of the radar matrix of a level, as dataframes with one row per (item, country) pair
+def matrixChunks(level, df_countries):
+    items = score_engine.getItems(level)
+    n_countries = len(df_countries.index)
+    chunk_items = max(EXPORT_CHUNK_ROWS // max(n_countries, 1), 1)
+    for start in range(0, len(items), chunk_items):
+        chunk = items[start:start + chunk_items]
+        dff = df_countries.iloc[np.tile(np.arange(n_countries), len(chunk))].reset_index(drop=True)
+        dff.insert(0, level, np.repeat(np.array(chunk, dtype=object), n_countries))
+        scores = score_engine.getScores(level, chunk, df_countries["iso3"])
+        dff[["Demanda", "Arancel"]] = np.nan_to_num(scores.reshape(-1, scores.shape[-1]))
+        yield dff
+
+#Generators of the export file, in CSV or Parquet
+def csvStream(chunks):
+    for idx, dff in enumerate(chunks):
+        yield dff.to_csv(index=False, header=idx == 0)
+
+def parquetStream(chunks):
+    import pyarrow
+    import pyarrow.parquet
+    sink = ChunkSink()
+    writer = None
+    for dff in chunks:
+        table = pyarrow.Table.from_pandas(dff, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+    yield sink.take()
+
+#Function to answer an export request
+def exportMatrix(level):
+    if level not in score_engine.LEVELS:
+        return flask.jsonify(error=f"The level must be one of {score_engine.LEVELS}"), 404
+    file_format = flask.request.args.get("format", "csv")
+    version = flask.request.args.get("version")
+    if file_format not in ("csv", "parquet") or (version is not None and version not in VERSION_COLUMNS):
+        return flask.jsonify(error=f"The format must be csv or parquet and the version one of {list(VERSION_COLUMNS)}"), 400
+    agreements = [agreement for agreement in flask.request.args.get("comercial", "").split(",") if agreement]
+    chunks = matrixChunks(level, getCountries([version] if version else list(VERSION_COLUMNS), agreements))
+    if file_format == "parquet":
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            return flask.jsonify(error="The Parquet format needs pyarrow, which is not installed"), 406
+        stream, mimetype = parquetStream(chunks), "application/vnd.apache.parquet"
+    else:
+        stream, mimetype = csvStream(chunks), "text/csv"
+    return flask.Response(stream, mimetype=mimetype,
+                          headers={"Content-Disposition": f"attachment; filename=radar_{level}.{file_format}"})
+
+#Function to add the export route to the Flask server of a Dash app
+def register(app):
+    app.server.add_url_rule("/api/export/<level>", "api_export", exportMatrix, methods=["GET"])
@@ -0,0 +1,152 @@
+import collections
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import re
+import shutil
+import threading
+from apps import data
+from apps import metrics
+
+#---------------------------------------------------------------
+# Cache configuration
+#Maximum number of results and total size of the results kept in the memory of each worker
+MAX_ENTRIES = int(os.environ.get("FIGURE_CACHE_ENTRIES", "512"))
+MAX_BYTES = int(os.environ.get("FIGURE_CACHE_MB", "128")) * 1024 * 1024
+#Optional folder shared by all the gunicorn workers, where every result is also saved, and its maximum size
+DISK_PATH = os.environ.get("FIGURE_CACHE_DIR")
+MAX_DISK_BYTES = int(os.environ.get("FIGURE_CACHE_DISK_MB", "1024")) * 1024 * 1024
+
+#----------------------------------------------------------------------------
+# This module memoizes the outputs of the callbacks that build Plotly figures. The outputs are kept already serialized to JSON,
+# keyed on the callback name, its inputs and the version of the data, with least-recently-used eviction in memory
+# and an optional disk tier. A cached output is returned as the parsed JSON, which Dash sends as it is.
+# The disk tier keeps the outputs of each version of the data in its own folder. The folders of the other versions are
+# removed, and so are the least recently used files when the tier is over its size (See pruneDisk).
+
+_cache = collections.OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+#Size of the disk tier as seen by this worker, None until it is first measured
+_disk_bytes = None
+_prune_lock = threading.Lock()
+stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+#Function to get the key of a callback call
+def cacheKey(name, args):
+    key = json.dumps([name, data.DATA_VERSION, args], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+#Function to get the path of a key in the disk tier
+def diskPath(key):
+    return pathlib.Path(DISK_PATH).joinpath(data.DATA_VERSION, key[:2], key + ".json")
+
+#Function to remove the folders of other versions of the data from the disk tier and, if it is over its size, its least
+#recently used files until it is 10% under it. Only the folders named like a version (hexadecimal) are removed
+def pruneDisk():
+    global _disk_bytes
+    root = pathlib.Path(DISK_PATH)
+    with _prune_lock:
+        if root.exists():
+            for folder in root.iterdir():
+                if folder.is_dir() and folder.name != data.DATA_VERSION and re.fullmatch("[0-9a-f]+", folder.name):
+                    shutil.rmtree(folder, ignore_errors=True)
+        files = []
+        for path in root.joinpath(data.DATA_VERSION).glob("*/*.json"):
+            #Other workers may remove files at the same time
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        if total > MAX_DISK_BYTES:
+            for _, size, path in sorted(files):
+                path.unlink(missing_ok=True)
+                total -= size
+                if total <= MAX_DISK_BYTES * 0.9:
+                    break
+        with _lock:
+            _disk_bytes = total
+
+#Function to get a serialized output from memory or disk, and where it was found ("hit", "disk_hit" or "miss").
+#The output is None if it is not cached
+def lookup(key):
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            stats["hits"] += 1
+            return _cache[key], "hit"
+    if DISK_PATH is not None:
+        try:
+            payload = diskPath(key).read_text(encoding="utf-8")
+            #The time of the file is its last use, for the eviction of the disk tier
+            os.utime(diskPath(key))
+        except FileNotFoundError:
+            payload = None
+        if payload is not None:
+            put(key, payload, disk=False)
+            with _lock:
+                stats["disk_hits"] += 1
+            return payload, "disk_hit"
+    with _lock:
+        stats["misses"] += 1
+    return None, "miss"
+
+#Function to get a serialized output from memory or disk. Returns None if it is not cached
+def get(key):
+    return lookup(key)[0]
+
+#Function to save a serialized output, removing the least recently used ones when the cache is full
+def put(key, payload, disk=True):
+    global _cache_bytes, _disk_bytes
+    size = len(payload)
+    if size <= MAX_BYTES:
+        with _lock:
+            if key in _cache:
+                _cache_bytes -= len(_cache.pop(key))
+            _cache[key] = payload
+            _cache_bytes += size
+            while len(_cache) > MAX_ENTRIES or _cache_bytes > MAX_BYTES:
+                _, old_payload = _cache.popitem(last=False)
+                _cache_bytes -= len(old_payload)
+                stats["evictions"] += 1
+    if disk and DISK_PATH is not None:
+        #The file is written with a temporary name and renamed, so other workers never read it half written.
+        #The name has the process and the thread, as two threads may save the same key at the same time
+        path = diskPath(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(payload, encoding="utf-8")
+        os.replace(tmp_path, path)
+        with _lock:
+            if _disk_bytes is not None:
+                _disk_bytes += size
+            prune = _disk_bytes is None or _disk_bytes > MAX_DISK_BYTES
+        if prune:
+            pruneDisk()
+
+#Function to get the current number of entries and bytes in memory, together with the counters
+def cacheStats():
+    with _lock:
+        return dict(stats, entries=len(_cache), bytes=_cache_bytes)
+
+#Decorator for the callbacks whose outputs are cached. It goes below @app.callback
+def cachedCallback(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = cacheKey(name, args)
+            payload, result = lookup(key)
+            metrics.recordCache(name, result)
+            if payload is not None:
+                return json.loads(payload)
+            result = func(*args)
+            #Imported here because plotly.io.json is slow to import and the boot doesn't need it
+            from plotly.io.json import to_json_plotly
+            put(key, to_json_plotly(result))
+            return result
+        return wrapper
+    return decorator
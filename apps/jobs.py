@@ -0,0 +1,165 @@
+import atexit
+import concurrent.futures
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+#---------------------------------------------------------------
+# Jobs configuration
+#SQLite file with the state and the results of the jobs, shared by all the gunicorn workers
+JOBS_DB = os.environ.get("JOBS_DB", "jobs.sqlite")
+#Processes of the pool of each gunicorn worker. With 0 the jobs run in a thread of the worker instead
+JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS", "2"))
+#Seconds a finished job is kept in the database, and seconds without progress after which a queued or running job
+#is considered lost (e.g. its worker was restarted) and can be submitted again
+JOBS_TTL = int(os.environ.get("JOBS_TTL", "3600"))
+JOBS_STALE = int(os.environ.get("JOBS_STALE", "300"))
+
+#----------------------------------------------------------------------------
+# This module runs the slow callbacks (e.g. the clustering model) as background jobs on a local process pool, so they don't
+# hold a gunicorn worker while they run. Each job is identified by a key (The figure cache key of its callback and inputs) and
+# its state, progress and serialized result are kept in SQLite, so any worker can poll a job started by another one and
+# identical requests share a single job. Each request that submits a job subscribes to it, and cancel() only removes that
+# subscription: the job is cancelled when no subscribers are left, by changing its state, and it stops at its next call
+# to progress(). The polls of the state only read the database, so they don't wait for the writes of the jobs.
+
+_pool = None
+_futures = {}
+_lock = threading.Lock()
+_job = threading.local()
+_created = False
+
+#Raised inside a job by progress() when the job has been cancelled
+class JobCancelled(Exception):
+    pass
+
+#Function to open a transaction on the jobs database, creating its table the first time. With write=False the connection
+#only reads, without a transaction, so it doesn't take the write lock
+@contextlib.contextmanager
+def transaction(write=True):
+    global _created
+    con = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    try:
+        if not _created:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("""CREATE TABLE IF NOT EXISTS jobs (key TEXT PRIMARY KEY, status TEXT, progress REAL, message TEXT,
+                           result TEXT, error TEXT, created REAL, updated REAL, subscribers INTEGER)""")
+            #The databases created before the subscribers were counted get the column
+            with contextlib.suppress(sqlite3.OperationalError):
+                con.execute("ALTER TABLE jobs ADD COLUMN subscribers INTEGER DEFAULT 1")
+            _created = True
+        if not write:
+            yield con
+            return
+        #The write lock is taken at the start, so two workers can't both see a job missing and submit it
+        con.execute("BEGIN IMMEDIATE")
+        yield con
+        con.execute("COMMIT")
+    except BaseException:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+#Function to update the fields of a job if it is in one of the given states. Returns False if it wasn't
+def updateJob(key, statuses, **fields):
+    fields["updated"] = time.time()
+    with transaction() as con:
+        cursor = con.execute(f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in fields)} "
+                             f"WHERE key = ? AND status IN ({', '.join('?' * len(statuses))})",
+                             [*fields.values(), key, *statuses])
+        return cursor.rowcount > 0
+
+#Function to get the pool of this process. It is created on the first job, so the gunicorn workers forked
+#from a preloaded app each get their own
+def getPool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            if JOBS_WORKERS > 0:
+                _pool = concurrent.futures.ProcessPoolExecutor(JOBS_WORKERS)
+            else:
+                _pool = concurrent.futures.ThreadPoolExecutor(1)
+            #The queued jobs are dropped when the worker exits
+            atexit.register(_pool.shutdown, cancel_futures=True)
+        return _pool
+
+#Function to run a job in the pool and save its result, serialized to JSON like the figure cache does
+def runJob(key, func, args):
+    #The job may have been cancelled while it was queued
+    if not updateJob(key, ("queued",), status="running"):
+        return
+    _job.key = key
+    try:
+        result = func(*args)
+        from plotly.io.json import to_json_plotly
+        updateJob(key, ("running",), status="done", progress=1.0, message="", result=to_json_plotly(result))
+    except JobCancelled:
+        pass
+    except Exception as e:
+        updateJob(key, ("running",), status="failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        _job.key = None
+
+#Function called when a future of the pool finishes, to record the failures of the pool itself (e.g. a killed process)
+def jobFinished(key, future):
+    global _pool
+    with _lock:
+        _futures.pop(key, None)
+    if future.cancelled() or future.exception() is None:
+        return
+    updateJob(key, ("queued", "running"), status="failed", error=f"{type(future.exception()).__name__}: {future.exception()}")
+    if isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+        with _lock:
+            _pool = None
+
+#Function to submit a job and subscribe to it, unless the same job is already done. If it is queued or running, the caller
+#subscribes to that job instead. Returns True if it was submitted
+def submit(key, func, *args):
+    now = time.time()
+    with transaction() as con:
+        con.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated < ?", (now - JOBS_TTL,))
+        row = con.execute("SELECT status, updated FROM jobs WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] == "done":
+            return False
+        if row is not None and row[0] in ("queued", "running") and now - row[1] < JOBS_STALE:
+            con.execute("UPDATE jobs SET subscribers = subscribers + 1 WHERE key = ?", (key,))
+            return False
+        con.execute("""INSERT OR REPLACE INTO jobs (key, status, progress, message, result, error, created, updated, subscribers)
+                       VALUES (?, 'queued', 0, '', NULL, NULL, ?, ?, 1)""", (key, now, now))
+    future = getPool().submit(runJob, key, func, args)
+    with _lock:
+        _futures[key] = future
+    future.add_done_callback(lambda future: jobFinished(key, future))
+    return True
+
+#Function to get the state of a job: a dict with its status, progress (0 to 1), message, result and error. None if it doesn't exist
+def status(key):
+    with transaction(write=False) as con:
+        row = con.execute("SELECT status, progress, message, result, error FROM jobs WHERE key = ?", (key,)).fetchone()
+    return None if row is None else dict(zip(["status", "progress", "message", "result", "error"], row))
+
+#Function to remove a subscription to a job, and cancel the job if it has no subscribers left. A cancelled job that is
+#queued in this process is removed from the pool, any other one stops at its next progress(). Returns True if it was cancelled
+def cancel(key):
+    with transaction() as con:
+        con.execute("UPDATE jobs SET subscribers = subscribers - 1 WHERE key = ? AND status IN ('queued', 'running') AND subscribers > 0",
+                    (key,))
+        cancelled = con.execute("UPDATE jobs SET status = 'cancelled', updated = ? WHERE key = ? AND status IN ('queued', 'running') "
+                                "AND subscribers <= 0", (time.time(), key)).rowcount > 0
+    if cancelled:
+        with _lock:
+            future = _futures.get(key)
+        if future is not None:
+            future.cancel()
+    return cancelled
+
+#Function to report the progress of the current job, from 0 to 1. It raises JobCancelled if the job was cancelled,
+#and does nothing when the function runs outside a job
+def progress(fraction, message=""):
+    key = getattr(_job, "key", None)
+    if key is not None and not updateJob(key, ("running",), progress=fraction, message=message):
+        raise JobCancelled()
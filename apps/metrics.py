@@ -0,0 +1,188 @@
+import collections
+import flask
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+
+#---------------------------------------------------------------
+# Metrics configuration
+#Optional folder shared by all the gunicorn workers. Each worker saves its counters there and /metrics adds them all up.
+#The counters of the workers that are no longer running are removed, like a restart of a counter in Prometheus
+METRICS_DIR = os.environ.get("METRICS_DIR")
+#With METRICS_LOG=1 every callback request also prints a JSON line with its metrics
+METRICS_LOG = os.environ.get("METRICS_LOG", "0") == "1"
+#Minimum seconds between two saves of the counters of a worker to METRICS_DIR
+SAVE_INTERVAL = 1.0
+
+#----------------------------------------------------------------------------
+# This module records the wall time and response size of every Dash callback request (/_dash-update-component), and the hits
+# of the figure cache, and serves them in the Prometheus text format on /metrics. Every value is kept as a counter,
+# the histograms included (One counter per bucket), so the counters of several workers are merged by adding them.
+# The clientside callbacks (e.g. the dropdown cascades) run in the browser and never reach the server.
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+BYTES_BUCKETS = [1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7]
+#Type and description of each metric
+METRICS = {
+    "radar_callback_duration_seconds": ("histogram", "Wall time of the Dash callback requests"),
+    "radar_callback_response_bytes": ("histogram", "Size of the serialized responses of the Dash callbacks"),
+    "radar_callback_requests_total": ("counter", "Dash callback requests by response status"),
+    "radar_figure_cache_requests_total": ("counter", "Lookups in the figure cache by result (hit, disk_hit or miss)"),
+}
+
+_counters = collections.defaultdict(float)
+_lock = threading.Lock()
+#Held while the counters are written to METRICS_DIR, so the threads of a worker don't share the temporary file and an
+#older snapshot never replaces a newer one
+_save_lock = threading.Lock()
+_last_save = 0.0
+
+#Function to add a value to a counter. The labels are a tuple of (name, value) pairs
+def increment(name, labels, value=1.0, suffix=""):
+    with _lock:
+        _counters[(name, suffix, labels)] += value
+
+#Function to record an observation in a histogram: its cumulative buckets, sum and count
+def observe(name, labels, value, buckets):
+    with _lock:
+        for bucket in buckets + [float("inf")]:
+            _counters[(name, "_bucket", labels + (("le", formatValue(bucket)),))] += 1 if value <= bucket else 0
+        _counters[(name, "_sum", labels)] += value
+        _counters[(name, "_count", labels)] += 1
+
+#Function to record a lookup of the figure cache. Called by figure_cache.cachedCallback
+def recordCache(callback, result):
+    increment("radar_figure_cache_requests_total", (("callback", callback), ("result", result)))
+    if flask.has_request_context():
+        flask.g.metrics_cache = result
+
+#Function to write a number like Prometheus does
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+#Function to escape a label value for the Prometheus text format
+def escapeLabel(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+#Function to get the name of the callback of a request, from the output it updates
+def callbackName(app, body):
+    output = body.get("output", "")
+    callback = app.callback_map.get(output, {}).get("callback")
+    return getattr(callback, "__name__", "unknown"), output
+
+#----------------------------------------------------------------------------
+# Counters of all the workers
+
+#Function to save the counters of this worker to METRICS_DIR, at most once per SAVE_INTERVAL unless forced
+def saveCounters(force=False):
+    global _last_save
+    if METRICS_DIR is None:
+        return
+    with _lock:
+        if not force and time.time() - _last_save < SAVE_INTERVAL:
+            return
+        _last_save = time.time()
+    with _save_lock:
+        with _lock:
+            snapshot = [[name, suffix, list(labels), value] for (name, suffix, labels), value in _counters.items()]
+        path = pathlib.Path(METRICS_DIR)
+        path.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.joinpath(f"metrics-{os.getpid()}.json.tmp")
+        tmp_path.write_text(json.dumps(snapshot), encoding="utf-8")
+        os.replace(tmp_path, path.joinpath(f"metrics-{os.getpid()}.json"))
+
+#Function to know if a process is running
+def processAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+#Function to remove the counters saved by the workers that are no longer running, and by this process if it isn't
+#forced to keep them (e.g. left by an earlier process with the same pid)
+def removeStale(keep_own=True):
+    if METRICS_DIR is None or not pathlib.Path(METRICS_DIR).exists():
+        return
+    for path in pathlib.Path(METRICS_DIR).glob("metrics-*.json"):
+        pid = int(re.fullmatch(r"metrics-(\d+)\.json", path.name).group(1))
+        if (pid == os.getpid() and not keep_own) or (pid != os.getpid() and not processAlive(pid)):
+            path.unlink(missing_ok=True)
+
+#Function to get the counters of this worker plus the ones saved by the other workers that are running
+def allCounters():
+    with _lock:
+        counters = collections.defaultdict(float, _counters)
+    removeStale()
+    if METRICS_DIR is not None and pathlib.Path(METRICS_DIR).exists():
+        for path in pathlib.Path(METRICS_DIR).glob("metrics-*.json"):
+            if path.name == f"metrics-{os.getpid()}.json":
+                continue
+            try:
+                saved = json.loads(path.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                #Removed by another worker since it was listed
+                continue
+            for name, suffix, labels, value in saved:
+                counters[(name, suffix, tuple(tuple(label) for label in labels))] += value
+    return counters
+
+#Function to sort the series of a metric by their labels, with the buckets of each histogram in increasing order
+def seriesOrder(item):
+    (_, suffix, labels), _ = item
+    le = dict(labels).get("le")
+    return [label for label in labels if label[0] != "le"], suffix, float(le.replace("+Inf", "inf")) if le else 0.0
+
+#Function to write the counters in the Prometheus text format
+def renderMetrics(counters):
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (metric, suffix, labels), value in sorted(counters.items(), key=seriesOrder):
+            if metric == name:
+                label_text = ",".join(f'{label}="{escapeLabel(label_value)}"' for label, label_value in labels)
+                lines.append(f"{name}{suffix}{{{label_text}}} {formatValue(value)}")
+    return "\n".join(lines) + "\n"
+
+#----------------------------------------------------------------------------
+#Function to add the instrumentation and the /metrics route to the Flask server of a Dash app
+def instrument(app):
+    server = app.server
+    #The counters of an earlier process start again from 0
+    removeStale(keep_own=False)
+
+    @server.before_request
+    def startTimer():
+        if flask.request.path.endswith("/_dash-update-component"):
+            flask.g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def recordRequest(response):
+        if "metrics_start" not in flask.g:
+            return response
+        duration = time.perf_counter() - flask.g.metrics_start
+        body = flask.request.get_json(silent=True) or {}
+        callback, output = callbackName(app, body)
+        labels = (("callback", callback), ("output", output))
+        size = response.calculate_content_length() or 0
+        observe("radar_callback_duration_seconds", labels, duration, DURATION_BUCKETS)
+        observe("radar_callback_response_bytes", labels, size, BYTES_BUCKETS)
+        increment("radar_callback_requests_total", labels + (("status", str(response.status_code)),))
+        if METRICS_LOG:
+            print(json.dumps({"event": "callback", "callback": callback, "output": output, "status": response.status_code,
+                              "seconds": round(duration, 6), "bytes": size, "cache": flask.g.get("metrics_cache"), "pid": os.getpid()}), flush=True)
+        saveCounters()
+        return response
+
+    @server.route("/metrics")
+    def metricsRoute():
+        saveCounters(force=True)
+        return flask.Response(renderMetrics(allCounters()), mimetype="text/plain; version=0.0.4")
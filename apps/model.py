@@ -1,35 +1,33 @@
 import pandas as pd
+import threading
+import json
 import plotly.express as px
-import pathlib
 from app import app
 
 import dash 
 from dash import dcc
 from dash import html
-from dash import dash_table
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from apps import navbar
+from apps import data
 from apps import cluster
+from apps import score_engine
+from apps import figure_cache
+from apps import jobs
+from apps import metrics
+from apps import tables
 
-#---------------------------------------------------------------
-# Data Loading
-PATH = pathlib.Path(__file__).parent
-DATA_PATH = PATH.joinpath("../data").resolve()
-# Loading Country-level Data
-df_paises = pd.read_csv(DATA_PATH.joinpath("df_indices_paises.csv"),sep=";")
-rename_cat={'iso3':"iso3", 'nombre':"Nombre_pais",'epi':"Sostenibilidad/EPI", 
-            'innovacion':"Innovación", 'competitividad':"Competitividad",'distancia':"Distancia"}
-df_paises.rename(columns=rename_cat, inplace=True)
-# Loading product-level Data
-df_productos = pd.read_csv(DATA_PATH.joinpath('df_productos.csv'),dtype={'producto': str})
-df_relaciones_productos = pd.read_csv(DATA_PATH.joinpath("relaciones_productos.csv"),sep=";")
-df_relaciones_productos["label_productos"] = df_relaciones_productos["producto"] + "-" + df_relaciones_productos["desc_producto"]
-lista_sectores = sorted(df_relaciones_productos["sector"].unique()) + ["Todos"]
+#Description of how the silhouette score shown with the results was calculated (See cluster.scoreClusters)
+modos_silueta = {"exact": "cálculo exacto", "sampled": f"estimado con una muestra de {cluster.SILHOUETTE_SAMPLE_SIZE} países",
+                 "cached": "cálculo exacto guardado en caché", "stored": "precalculado"}
 
 #---------------------------------------------------------------
 #Page layout
-layout = html.Div([
+def buildLayout():
+    #Sector options. The data is loaded once for all the pages in data.py
+    lista_sectores = sorted(data.df_relaciones_productos["sector"].unique()) + ["Todos"]
+    return html.Div([
         navbar.navbar,
         #Title
         dbc.Row([html.H1("Modelo de Clusterización", style={'textAlign':'center',"margin-top":"16px"}),html.Hr()],
@@ -103,6 +101,15 @@ layout = html.Div([
                 ),
         #This is a summary of the model used
         dbc.Row(html.P(id="model-explanation", style={'textAlign':'center',"margin-top":"16px"})),
+        #Progress of the model, which runs as a background job (See jobs.py). The interval polls the job while it runs
+        dbc.Row([
+            dbc.Col(dbc.Progress(id="model-progress", value=0, label="", striped=True, animated=True, color="danger"), width=9),
+            dbc.Col(dbc.Button("Cancelar", id="model-cancel", color="secondary", size="sm", disabled=True), width=3),
+            dcc.Interval(id="model-job-interval", interval=500, disabled=True),
+            dcc.Store(id="model-job"),
+            ],
+            style={"max-width":"600px","margin":"auto","align-items":"center"}
+        ),
         #Main results of the model shown as an animated map
         dbc.Row(
             dbc.Spinner(children=[dcc.Graph(id="clusters_graph")], 
@@ -135,37 +142,44 @@ layout = html.Div([
             ],
             style={"max-width":"1200px","margin":"auto","textAlign":"center","justify-content":"center", "align-items":"center",}
         ),
-        
+    
   ], style={"background": "white","margin":"0", "min-height":"100vh",}
 )
 
+_lock = threading.Lock()
+
+#Function to build the layout once, the first time it is used or in the warmup (See index.py)
+def loadLayout():
+    with _lock:
+        if "layout" not in globals():
+            globals()["layout"] = buildLayout()
+
+#The layout is a module attribute, like the dataframes of data.py, that is built on first access because its dropdowns need the data
+def __getattr__(name):
+    if name == "layout":
+        loadLayout()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 #---------------------------------------------------------------
 #Callback Functions
-# Populate the options of subsectors dropdown based on sectors dropdown
-@app.callback(
+# Populate the options of subsectors dropdown based on sectors dropdown. It runs in the browser (See assets/cascade.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='cascade', function_name='modelSubsectores'),
     [Output('subsec_cluster', 'disabled'),
    Output('subsec_cluster', 'options')],
-    Input('sec_cluster', 'value')
+    Input('sec_cluster', 'value'),
+    State('jerarquia-productos', 'data')
 )
-def set_subsectores_options(chosen_sector):
-    if chosen_sector=="Todos":
-        return True, []
-    else:
-        dff = df_relaciones_productos[df_relaciones_productos["sector"]==chosen_sector]
-        return False, [{'label': c, 'value': c} for c in sorted(dff["subsector"].unique())]
 
-# Populate values of products dropdown based on subsectors selection or give entire products list
-@app.callback(
+# Populate values of products dropdown based on subsectors selection or give entire products list. It runs in the browser (See assets/cascade.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='cascade', function_name='modelProductos'),
    [Output('producto_cluster', 'value'),
    Output('producto_cluster', 'options')],
-    Input('subsec_cluster', 'value')
+    Input('subsec_cluster', 'value'),
+    State('jerarquia-productos', 'data')
 )
-def set_productos_options(chosen_subsector):
-    if chosen_subsector is None:
-        return "090111", [{'label': c, 'value': c[:6]} for c in sorted(df_relaciones_productos["label_productos"])]
-    else:
-        dff = df_relaciones_productos[df_relaciones_productos["subsector"]==chosen_subsector]
-        return "090111", [{'label': c, 'value': c[:6]} for c in sorted(dff["label_productos"])]
 
 # Populate values of variables dropdown based on the radar version
 @app.callback(
@@ -190,11 +204,11 @@ def set_productos_options(radar_choice):
     [Input(component_id='input_index', component_property='value'),
     Input(component_id='producto_cluster', component_property='value')]
 )
+@figure_cache.cachedCallback("build_graph")
 def build_graph(plot_option, product_selected):
     #Adding the tariff and demand score columns based on the product selected
-    dff=df_paises.copy()
-    dff_prod = df_productos.loc[(df_productos["producto"] == product_selected), ["iso3","Demanda","Arancel"]]
-    df_joined = pd.merge(dff, dff_prod, on='iso3', how='left')
+    df_joined = data.df_paises.reset_index(drop=True)
+    df_joined[["Demanda","Arancel"]] = score_engine.getScores("producto", [product_selected], df_joined["iso3"])[0]
     #Setting the color scales for the map
     colors_scale = px.colors.diverging.RdYlGn
     #Creating the cloropleth map based on the dropdown option selected and updating its format
@@ -209,29 +223,22 @@ def build_graph(plot_option, product_selected):
                     
     return fig
 
-#Do clustering model with the product and number of clusters, output cloropleth map, sankey graph and summary table
-@app.callback(
-    [Output(component_id='results_tableCluster', component_property='children'),
-    Output(component_id='clusters_graph', component_property='figure'),
-    Output(component_id='radar_clusters', component_property='figure'),
-     Output(component_id='sankey_graph', component_property='figure'),
-     Output(component_id='model-explanation', component_property='children')],
-     [Input(component_id='producto_cluster', component_property='value'),
-      Input(component_id='radar_choice', component_property='value')]
-)
-def model_results(producto, radar_v):
+#Do clustering model with the product and number of clusters, output cloropleth map, sankey graph and summary table.
+#It runs as a background job (See model_results below), and reports its progress with jobs.progress
+def buildModelResults(producto, radar_v):
     #Selecting the indexes to get results based on the radar choice selected
     if radar_v == "Competitividad":
         cols_to_avg = ["Competitividad", "Innovación", "Sostenibilidad/EPI", "Distancia","Arancel","Demanda"]
     else:
         cols_to_avg = ["Sostenibilidad", "Desarrollo", "Oportunidad", "Arancel","Demanda"]
     #Get dataframe with the results of the clusterization model based on the function in cluster.py
-    dff, sil_sc = cluster.getClusterModel(producto, radar_v, 10)
+    jobs.progress(0.1, "Calculando los clústeres")
+    dff, sil_sc, sil_mode = cluster.getClusterModel(producto, radar_v, 10)
+    jobs.progress(0.6, "Construyendo las gráficas")
     #Sort and organize the data
     dff.sort_values(by=['cluster'], ascending = False,inplace=True)
     dff["cluster"] = dff["cluster"] + 1
     dff.rename(columns={"cluster":"Clúster", "Nombre_pais":"País"}, inplace=True)
-    columns = ["País","Puntaje medio","Clúster"]
     #Get sankey figure from the cluster.py function and update its format
     _, sankey_fig = cluster.getSankey(dff)
     sankey_fig.update_traces(textfont_size=20)
@@ -243,16 +250,16 @@ def model_results(producto, radar_v):
     dff["Clúster"] = dff["Clúster"].astype('category')
     #Calculate mean score for the summary table
     dff["Puntaje medio"] = dff[cols_to_avg].mean(axis = 1, numeric_only=True).round(2)
-    #Make dash data table with the results of the model
-    table = dash_table.DataTable(
-                        columns=[{"name": c, "id": c} for c in columns],
-                        data=dff[["País","Puntaje medio","Clúster"]].to_dict("records"),
+    #Make dash data table with the results of the model. It is paged, sorted and filtered on the server (See tables.py)
+    df_table = dff[["País","Puntaje medio","Clúster"]].astype({"Clúster": int})
+    table = tables.pagedTable("model-results-table", "model", (producto, radar_v), df_table,
                         style_cell={'textAlign': 'center','font-family':'Segoe UI'}, style_as_list_view=True,
                         style_data={'color': 'white','backgroundColor': '#152F4F'}, 
                         style_header={'backgroundColor': '#373B44','color': 'white','fontWeight': 'bold'},
-                        page_size=10, sort_action="native", filter_action="native", export_format="xlsx",
+                        page_size=10, sort_action="custom", sort_mode="multi", filter_action="custom",
                     )
     colors = ['#3366CC', '#DC3912', '#FF9900', '#109618', '#990099', '#0099C6', '#DD4477', '#66AA00', '#B82E2E', '#316395']
+    jobs.progress(0.8, "Construyendo el mapa")
     #Make cloropleth map with the results of the model and update its format
     map_fig = px.choropleth(dff, locations="iso3",
                             color="Clúster",
@@ -266,6 +273,86 @@ def model_results(producto, radar_v):
     map_fig.update_layout(title_text='Mapa interactivo de Clústeres', title_x=0.5)
     map_fig.update_layout(height=600)
     #Small description of the model and the calculation of the silouehette score
-    results_text = "El algoritmo de clusterización utilizado es k-means, con el cual se obtiene un puntaje de silueta promedio de: " + str(round(sil_sc*100,1)) + "%"
+    results_text = "El algoritmo de clusterización utilizado es k-means, con el cual se obtiene un puntaje de silueta promedio de: " + str(round(sil_sc*100,1)) + "%" + f" ({modos_silueta[sil_mode]})"
+
+    #The frame of the table is returned too, because the job runs in another process and the paging callback needs it
+    return table, map_fig, radar_fig, sankey_fig, results_text, tables.frameData(df_table)
+
+#Function to get the frame of the table of a model from its cached results, or from its finished job. The model is never
+#fitted in the paging callback: if its results are gone, its job is submitted again and the page stays empty (None)
+def getModelFrame(producto, radar_v):
+    key = figure_cache.cacheKey("model_results", (producto, radar_v))
+    payload, result = figure_cache.lookup(key)
+    metrics.recordCache("model_results", result)
+    if payload is None:
+        state = jobs.status(key)
+        if state is None or state["status"] in ("failed", "cancelled"):
+            jobs.submit(key, buildModelResults, producto, radar_v)
+        if state is None or state["status"] != "done":
+            return None
+        payload = state["result"]
+        figure_cache.put(key, payload)
+    return tables.toFrame(json.loads(payload)[5])
+
+#The table of a model is built again from its results when its frame is no longer cached
+tables.registerTable(app, "model-results-table", "model", getModelFrame)
+
+#Function to get the outputs of the model callback for the results of a model, keeping the frame of its table for the paging
+def showResults(producto, radar_v, results, disk=True):
+    tables.saveFrame("model", (producto, radar_v), results[5], disk=disk)
+    return results[:5] + [None, True, 100, "", True]
 
-    return table, map_fig, radar_fig, sankey_fig, results_text
+#Callback of the model results. Instead of running the model in the request, it submits it as a background job, and the interval
+#polls the job until its results are ready. Identical models requested by several users share the same job and the results
+#are kept in the figure cache, with the frame of the table for its paging. Returns the five results, the job key, whether the polling is disabled, the progress and
+#whether the cancel button is disabled
+@app.callback(
+    [Output(component_id='results_tableCluster', component_property='children'),
+    Output(component_id='clusters_graph', component_property='figure'),
+    Output(component_id='radar_clusters', component_property='figure'),
+     Output(component_id='sankey_graph', component_property='figure'),
+     Output(component_id='model-explanation', component_property='children'),
+     Output(component_id='model-job', component_property='data'),
+     Output(component_id='model-job-interval', component_property='disabled'),
+     Output(component_id='model-progress', component_property='value'),
+     Output(component_id='model-progress', component_property='label'),
+     Output(component_id='model-cancel', component_property='disabled')],
+     [Input(component_id='producto_cluster', component_property='value'),
+      Input(component_id='radar_choice', component_property='value'),
+      Input(component_id='model-job-interval', component_property='n_intervals'),
+      Input(component_id='model-cancel', component_property='n_clicks')],
+     State(component_id='model-job', component_property='data')
+)
+def model_results(producto, radar_v, n_intervals, n_clicks, job):
+    trigger = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
+    no_results = [dash.no_update] * 4
+    #Cancelling only stops the job if no other user is waiting for the same model (See jobs.py)
+    if trigger == "model-cancel":
+        jobs.cancel(job)
+        return no_results + ["Se canceló el modelo", None, True, 0, "", True]
+    key = figure_cache.cacheKey("model_results", (producto, radar_v))
+    if trigger != "model-job-interval":
+        payload, result = figure_cache.lookup(key)
+        metrics.recordCache("model_results", result)
+        if payload is not None:
+            #This user no longer waits for the job of the previous inputs
+            if job is not None:
+                jobs.cancel(job)
+            return showResults(producto, radar_v, json.loads(payload), disk=False)
+        #The job of the previous inputs is no longer needed by this user. The inputs of the current job may be sent again,
+        #then this user is already subscribed to it
+        if job != key:
+            if job is not None:
+                jobs.cancel(job)
+            jobs.submit(key, buildModelResults, producto, radar_v)
+    state = jobs.status(key)
+    #The job was removed from the database, or cancelled when its last subscriber left before this user subscribed
+    if state is None or state["status"] == "cancelled":
+        jobs.submit(key, buildModelResults, producto, radar_v)
+        state = jobs.status(key)
+    if state["status"] == "done":
+        figure_cache.put(key, state["result"])
+        return showResults(producto, radar_v, json.loads(state["result"]))
+    if state["status"] == "failed":
+        return no_results + [f"No se pudo generar el modelo ({state['error']})", None, True, 0, "", True]
+    return no_results + [dash.no_update, key, False, round(state["progress"] * 100), state["message"], False]
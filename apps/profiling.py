@@ -0,0 +1,125 @@
+import cProfile
+import collections
+import flask
+import hashlib
+import os
+import pathlib
+import pstats
+import random
+import re
+import sys
+import time
+from apps import metrics
+
+#---------------------------------------------------------------
+# Profiling configuration
+#Fraction of the callback requests that are profiled, 0 (the default) disables the profiling
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", "0"))
+#Folder where the profiles are saved, only the newest PROFILE_MAX_FILES are kept
+PROFILE_DIR = pathlib.Path(os.environ.get("PROFILE_DIR", "profiles"))
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "200"))
+
+#----------------------------------------------------------------------------
+# This module profiles with cProfile a random sample of the Dash callback requests (/_dash-update-component), from the
+# parsing of the request to the serialization of the response. Each profile is saved in its own file, named after the
+# callback and its output id. The profiles of each callback can be summarized running from the repository root:
+#   python -m apps.profiling [folder] [--callback name] [--top N]
+# The summary splits the time between the libraries (pandas, k-means, silhouette, Plotly...) and lists the slowest functions.
+
+#Groups of functions for the summary, by the path of their file
+LIBRARIES = collections.OrderedDict([
+    ("k-means", "sklearn/cluster"),
+    ("silhouette", "sklearn/metrics"),
+    ("scikit-learn (others)", "sklearn"),
+    ("pandas", "pandas"),
+    ("numpy", "numpy"),
+    ("plotly", "plotly"),
+    ("json", "json"),
+    ("dash/flask", ("dash", "flask", "werkzeug")),
+    ("app", "apps"),
+])
+
+#Function to get the name of the profile file of a callback request: <callback>.<output id hash>.<time>.<pid>.prof
+def profileName(callback, output):
+    output_hash = hashlib.sha1(output.encode()).hexdigest()[:8]
+    return f"{re.sub(r'[^A-Za-z0-9_]', '_', callback)}.{output_hash}.{time.time_ns()}.{os.getpid()}.prof"
+
+#Function to remove the oldest profiles when there are more than PROFILE_MAX_FILES
+def rotateProfiles():
+    profiles = []
+    for path in PROFILE_DIR.glob("*.prof"):
+        #Other workers may remove profiles at the same time
+        try:
+            profiles.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    profiles = [path for _, path in sorted(profiles)]
+    for path in profiles[:max(len(profiles) - PROFILE_MAX_FILES, 0)]:
+        path.unlink(missing_ok=True)
+
+#Function to add the sampled profiling to the Flask server of a Dash app. It does nothing if PROFILE_RATE is 0
+def instrument(app):
+    if PROFILE_RATE <= 0:
+        return
+    server = app.server
+
+    @server.before_request
+    def startProfile():
+        if flask.request.path.endswith("/_dash-update-component") and random.random() < PROFILE_RATE:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                #Another profiler is already running in this process
+                return
+            flask.g.profile = profile
+
+    @server.after_request
+    def saveProfile(response):
+        profile = flask.g.pop("profile", None)
+        if profile is None:
+            return response
+        profile.disable()
+        callback, output = metrics.callbackName(app, flask.request.get_json(silent=True) or {})
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        profile.dump_stats(PROFILE_DIR.joinpath(profileName(callback, output)))
+        rotateProfiles()
+        return response
+
+#----------------------------------------------------------------------------
+# Report of the profiles
+
+#Function to get the library of a function of the profiles. The built-in functions have no file, so their name is used
+#instead, e.g. "<method 'reduce' of 'numpy.ufunc' objects>"
+def getLibrary(file_name, function_name):
+    file_name = file_name.replace("\\", "/")
+    for library, paths in LIBRARIES.items():
+        for path in ([paths] if isinstance(paths, str) else paths):
+            if f"/{path}/" in file_name or (file_name == "~" and re.search(rf"\b{path.replace('/', '.')}\b", function_name)):
+                return library
+    return "others"
+
+#Function to print the summary of the profiles of each callback in a folder
+def printReport(folder=PROFILE_DIR, callback=None, top=20):
+    profiles = collections.defaultdict(list)
+    for path in sorted(pathlib.Path(folder).glob("*.prof")):
+        profiles[path.name.split(".")[0]].append(str(path))
+    for name, paths in profiles.items():
+        if callback is not None and name != callback:
+            continue
+        stats = pstats.Stats(*paths)
+        #Own time of the functions of each library
+        libraries = collections.defaultdict(float)
+        for (file_name, _, function_name), (_, _, own_time, _, _) in stats.stats.items():
+            libraries[getLibrary(file_name, function_name)] += own_time
+        total = sum(libraries.values())
+        print(f"\n=== {name}: {len(paths)} requests, {total / len(paths) * 1000:.1f} ms per request")
+        for library, own_time in sorted(libraries.items(), key=lambda item: -item[1]):
+            print(f"    {library:<24} {own_time / len(paths) * 1000:>9.1f} ms {own_time / total * 100:>6.1f}%")
+        stats.sort_stats("cumulative").print_stats(top)
+
+if __name__ == '__main__':
+    args = [arg for idx, arg in enumerate(sys.argv[1:], 1) if not arg.startswith("--") and not sys.argv[idx - 1].startswith("--")]
+    printReport(args[0] if args else PROFILE_DIR,
+                sys.argv[sys.argv.index("--callback") + 1] if "--callback" in sys.argv else None,
+                int(sys.argv[sys.argv.index("--top") + 1]) if "--top" in sys.argv else 20)
@@ -1,41 +1,34 @@
 import numpy as np
 import pandas as pd
+import threading
 import plotly.express as px
 import plotly.graph_objects as go
-import pathlib
 
 import dash 
 from dash import dcc
 from dash import html
 from dash import dash_table
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction, ALL
 from dash.exceptions import PreventUpdate
 
 from app import app
 from apps import navbar
+from apps import data
 from apps import radar_df
+from apps import score_engine
+from apps import figure_cache
+from apps import tables
+from apps import ranking
+from apps import country_index
 #---------------------------------------------------------------
-#Get relative data folder
-PATH = pathlib.Path(__file__).parent
-DATA_PATH = PATH.joinpath("../data").resolve()
-
-# Loading Country-level Data
-df_paises = pd.read_csv(DATA_PATH.joinpath("df_indices_paises.csv"),sep=";")
-rename_cat={'nombre':"Nombre_pais",'epi':"Sostenibilidad/EPI", 
-            'innovacion':"Innovación", 'competitividad':"Competitividad",'distancia':"Distancia"}
-df_paises.rename(columns=rename_cat, inplace=True)
-df_idx_var = pd.read_csv(DATA_PATH.joinpath("df_idx_var.csv"),sep=";")
-
-# Loading product-level Data (Including sector and subsectors)
-df_relaciones_productos = pd.read_csv(DATA_PATH.joinpath("relaciones_productos.csv"),sep=";")
-df_relaciones_productos["label_productos"] = df_relaciones_productos["producto"] + "-" + df_relaciones_productos["desc_producto"]
-df_productos = pd.read_csv(DATA_PATH.joinpath('df_productos.csv'),dtype={'producto': str})
-#Default theme for the graphs
+#Default theme for the graphs. The data is loaded once for all the pages in data.py
 px.defaults.template = "ggplot2"
+
 #---------------------------------------------------------------
 #Page Layout
-layout = html.Div([
+def buildLayout():
+    return html.Div([
         navbar.navbar,
         #Title
         dbc.Row([html.H1("Radar de competitividad", style={'textAlign':'center',"margin-top":"16px"}), html.Hr()],
@@ -64,12 +57,12 @@ layout = html.Div([
                     html.Label("Acuerdo comercial", style={'fontSize':20, 'textAlign':'center'}),
                     dcc.Dropdown(
                         id='acuerdos_dpn', 
-                        options=[{'label': s, 'value': s} for s in sorted(df_paises["comercial"].unique())],
+                        options=[{'label': s, 'value': s} for s in sorted(data.df_paises["comercial"].unique())],
                     ),
                     html.Label("Nombre País", style={'fontSize':20, 'textAlign':'center'}),
                     dcc.Dropdown(
                         id='input_iso3', 
-                        options=[{'label': s, 'value': s} for s in sorted(df_paises["Nombre_pais"].unique())],
+                        options=[{'label': s, 'value': s} for s in sorted(data.df_paises["Nombre_pais"].unique())],
                         value=['Alemania'],clearable=False, multi=True,
                     ),
                 ]), style={'text-align': 'center','align-self':'center','justify-self':'center'}, md=12,lg=6
@@ -80,7 +73,7 @@ layout = html.Div([
                     html.Label("Sector", style={'fontSize':20, 'textAlign':'center'}),
                     dcc.Dropdown(
                         id='sectores-dpdn', 
-                        options=[{'label': s, 'value': s} for s in sorted(df_relaciones_productos["sector"].unique())],
+                        options=[{'label': s, 'value': s} for s in sorted(data.df_relaciones_productos["sector"].unique())],
                         value='Agroindustrial', clearable=False
                     ),
                     html.Label("Subsector", style={'fontSize':18, 'textAlign':'center'}),
@@ -108,6 +101,19 @@ layout = html.Div([
             html.Div(id="results_table"),
             style={"max-width":"80%","overflow-x":"scroll","margin":"auto","textAlign":"center","justify-content":"center", "align-items":"center",}
         ),
+        #Ranking of the best markets for the products selected, among all the countries, with a weight for each axis
+        dbc.Row(html.H2("Mejores mercados", style={'textAlign':'center',"margin-top":"16px"})),
+        dbc.Row(html.Div(id="axes_weights"), style={"max-width":"700px","margin":"auto"}),
+        dbc.Row(
+            html.Div(id="top_markets"),
+            style={"max-width":"80%","overflow-x":"scroll","margin":"auto","textAlign":"center","justify-content":"center", "align-items":"center",}
+        ),
+        #Best products to export to the first country selected
+        dbc.Row(html.H2("Mejores productos", style={'textAlign':'center',"margin-top":"16px"})),
+        dbc.Row(
+            html.Div(id="top_products"),
+            style={"max-width":"80%","overflow-x":"scroll","margin":"auto","textAlign":"center","justify-content":"center", "align-items":"center",}
+        ),
         #Section to display the indexes variation for every country selected
         dbc.Row(html.H2("Gráficas de comparación", style={'textAlign':'center',"margin-top":"16px"})),
         dbc.Row(html.P("Variación de los índices de los países seleccionados en los últimos 10 años", style={'textAlign':'center',"margin-top":"16px"})),
@@ -124,6 +130,21 @@ layout = html.Div([
         ),
 ], style={"background": "white","min-height":"100vh",})
 
+_lock = threading.Lock()
+
+#Function to build the layout once, the first time it is used or in the warmup (See index.py)
+def loadLayout():
+    with _lock:
+        if "layout" not in globals():
+            globals()["layout"] = buildLayout()
+
+#The layout is a module attribute, like the dataframes of data.py, that is built on first access because its dropdowns need the data
+def __getattr__(name):
+    if name == "layout":
+        loadLayout()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 #---------------------------------------------------------------
 #Callback Functions
 # Populate the options of countries based on comercial agreements
@@ -136,30 +157,44 @@ def set_countries_values(chosen_agreement):
     if chosen_agreement is None:
         return ["Estados Unidos de América"]
     else:
-        dff = df_paises[df_paises["comercial"]==chosen_agreement]
+        dff = data.df_paises[data.df_paises["comercial"]==chosen_agreement]
         return sorted(dff["Nombre_pais"].unique())
 
-# Populate the options of subsectors dropdown based on sectors dropdown
-@app.callback(
+# Populate the options of subsectors dropdown based on sectors dropdown. It runs in the browser (See assets/cascade.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='cascade', function_name='radarSubsectores'),
     Output('subsectores-dpdn', 'options'),
-    Input('sectores-dpdn', 'value')
+    Input('sectores-dpdn', 'value'),
+    State('jerarquia-productos', 'data')
 )
-def set_subsectores_options(chosen_sector):
-    dff = df_relaciones_productos[df_relaciones_productos["sector"]==chosen_sector]
-    return [{'label': c, 'value': c} for c in sorted(dff["subsector"].unique())]
 
-# Populate values of products dropdown based on subsectors selection or give entire products list
-@app.callback(
+# Populate values of products dropdown based on subsectors selection or give entire products list. It runs in the browser (See assets/cascade.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='cascade', function_name='radarProductos'),
     Output('productos-dpdn', 'options'),
-    Input('subsectores-dpdn', 'value')
+    Input('subsectores-dpdn', 'value'),
+    State('jerarquia-productos', 'data')
 )
-def set_productos_options(chosen_subsector):
-    #Selecting all the products if the user has not filtered by subsector, otherwise, select only the products within the given subsector
-    if chosen_subsector is None:
-        return [{'label': c, 'value': c[:6]} for c in sorted(df_relaciones_productos["label_productos"])]
-    else:
-        dff = df_relaciones_productos[df_relaciones_productos["subsector"]==chosen_subsector]
-        return [{'label': c, 'value': c[:6]} for c in sorted(dff["label_productos"])]
+
+#Function to get the columns of the radar and the results table based on the radar version
+def getColumns(radar_v):
+    if radar_v == "Competitividad":
+        return ["Sostenibilidad/EPI", "Innovación", "Competitividad", "Distancia", "Arancel", "Demanda"]
+    return ["Sostenibilidad", "Desarrollo", "Oportunidad", "Arancel", "Demanda"]
+
+#Function to get the radar dataframe and the country recommendations for the dropdown values. With recommend=False
+#the recommendations are not computed, so the clustering model is not needed
+def getRadarFrame(countries_selected, sector_selected, subsector_selected, products_selected, radar_v, recommend=True):
+    #This condition selects the right function to filter all the dataframes to get the required information for the radar plot and the similar countries recommendations
+    if products_selected is not None and len(products_selected) > 0:
+        return radar_df.get_radar_products(list(countries_selected), list(products_selected), radar_v, recommend)
+    dff_0 = radar_df.get_radar_sectors(list(countries_selected), sector_selected, subsector_selected, radar_v)
+    return dff_0, "Por favor elija un producto y un país para generar recomendaciones"
+
+#The results table is built again from its arguments when its frame is no longer cached, only from the scores: the
+#recommendations (and the clustering model they may fit) are not part of the table
+tables.registerTable(app, "radar-results-table", "radar",
+                     lambda *args: getRadarFrame(*args, recommend=False)[0][['Identificador'] + getColumns(args[-1])])
 
 # Callback to create the radar plot, results table and country recommendations based on the country and product-related dropdown values
 @app.callback(
@@ -173,17 +208,10 @@ def set_productos_options(chosen_subsector):
     Input(component_id='radar_choice', component_property='value')]
 )
 def update_output(countries_selected, sector_selected, subsector_selected, products_selected, radar_v):
-    #Selecting the columns basedon the radar version
-    if radar_v == "Competitividad":
-        columns = ["Sostenibilidad/EPI", "Innovación", "Competitividad", "Distancia", "Arancel", "Demanda"]
-    else:
-        columns = ["Sostenibilidad", "Desarrollo", "Oportunidad", "Arancel", "Demanda"]
-    #This condition selects the right function to filter all the dataframes to get the required information for the radar plot and the similar countries recommendations
-    if products_selected is not None and len(products_selected) > 0:
-        dff_0, recommendation = radar_df.get_radar_products(countries_selected, products_selected, radar_v)
-    else:
-        dff_0 = radar_df.get_radar_sectors(countries_selected, sector_selected, subsector_selected, radar_v)
-        recommendation = "Por favor elija un producto y un país para generar recomendaciones"
+    columns = getColumns(radar_v)
+    #Arguments of the results table, with the selections sorted as the functions of radar_df.py sort them
+    table_args = (sorted(countries_selected), sector_selected, subsector_selected, sorted(products_selected) if products_selected else None, radar_v)
+    dff_0, recommendation = getRadarFrame(countries_selected, sector_selected, subsector_selected, products_selected, radar_v)
     #The summary dataframe is converted to narrow format to input the radar plot
     df_radar = pd.melt(dff_0, id_vars=['Identificador'], var_name='index',value_name='value_idx', 
                         value_vars=columns)
@@ -196,29 +224,105 @@ def update_output(countries_selected, sector_selected, subsector_selected, produ
     #Styling the plot: Legend and background colors
     fig_radar.update_layout(legend=dict(orientation="h", yanchor="bottom", y=1.1, xanchor="right", x=1))
 
-    #Creating the results table shown below the radar plot
-    results_table = dash_table.DataTable(
-                    columns=[{"name": c, "id": c} for c in ['Identificador']+columns],
-                    data=dff_0.to_dict("records"),
+    #Creating the results table shown below the radar plot. It is paged and sorted on the server, so only the rows
+    #of the page shown are sent (See tables.py)
+    results_table = tables.pagedTable("radar-results-table", "radar", table_args, dff_0[['Identificador']+columns],
                     style_cell={'textAlign': 'center','font-family':'Segoe UI'}, style_as_list_view=True,
                     style_data={'color': 'white','backgroundColor': '#152F4F'},
                     style_header={'backgroundColor': '#373B44','color': 'white','fontWeight': 'bold'},
-                    page_size=10,sort_action="native",export_format="xlsx",
+                    page_size=10,sort_action="custom",sort_mode="multi",
                 )
     
     return fig_radar, results_table, recommendation
 
+# Sliders with the weight of each axis of the radar version in the ranking of the markets. They start at 1, the plain mean
+@app.callback(
+    Output(component_id='axes_weights', component_property='children'),
+    Input(component_id='radar_choice', component_property='value')
+)
+def update_axes_weights(radar_v):
+    return [html.P("Peso de cada eje en el puntaje de los mercados", style={'textAlign':'center'})] + [
+        dbc.Row([
+            dbc.Col(html.Label(axis), width=4),
+            dbc.Col(dcc.Slider(id={"type": "peso-eje", "axis": axis}, min=0, max=5, step=0.5, value=1,
+                               marks={value: str(value) for value in range(6)}, updatemode="drag"), width=8),
+        ]) for axis in ranking.AXES[radar_v]
+    ]
+
+# Ranking of the best markets for the products selected, by the weighted mean of the radar axes of every country (See ranking.py).
+# It runs on every move of the sliders, so it is not kept in the figure cache: the feature matrix of the products is kept
+# instead, and each new ranking is only its product with the weights
+@app.callback(
+    Output(component_id='top_markets', component_property='children'),
+    [Input(component_id='productos-dpdn', component_property='value'),
+    Input(component_id='radar_choice', component_property='value'),
+    Input(component_id={"type": "peso-eje", "axis": ALL}, component_property='value')],
+    State(component_id={"type": "peso-eje", "axis": ALL}, component_property='id')
+)
+def update_top_markets(products_selected, radar_v, weight_values, weight_ids):
+    if not products_selected:
+        return html.P("Elija un producto para ver los países con mejor puntaje para exportarlo", style={'textAlign':'center'})
+    #The sliders of the other version are ignored until the ones of this version are shown
+    weights = {weight_id["axis"]: value for weight_id, value in zip(weight_ids, weight_values)
+               if weight_id["axis"] in ranking.AXES[radar_v] and value is not None}
+    if weights and not any(weights.values()):
+        return html.P("Asigne un peso mayor que 0 a algún eje", style={'textAlign':'center'})
+    dff = ranking.rankMarkets(sorted(products_selected), radar_v, 10, weights).drop(columns=["iso3"]).round(2)
+    dff = dff.rename(columns={"producto": "Producto", "Nombre_pais": "País"})
+    if len(products_selected) == 1:
+        dff = dff.drop(columns=["Producto"])
+        title = f"Los 10 países con el mayor puntaje del radar para el producto {data.product_labels.get(products_selected[0], products_selected[0])}"
+    else:
+        title = "Los 10 países con el mayor puntaje del radar para cada producto elegido"
+    return [
+        html.P(title, style={'textAlign':'center'}),
+        dash_table.DataTable(
+                    columns=[{"name": c, "id": c} for c in dff.columns],
+                    data=dff.to_dict("records"),
+                    style_cell={'textAlign': 'center','font-family':'Segoe UI'}, style_as_list_view=True,
+                    style_data={'color': 'white','backgroundColor': '#152F4F'},
+                    style_header={'backgroundColor': '#373B44','color': 'white','fontWeight': 'bold'},
+                    page_size=10, sort_action="native", export_format="xlsx",
+                ),
+    ]
+
+# Best products for the first country selected, by the mean of its demand and tariff scores (See country_index.py)
+@app.callback(
+    Output(component_id='top_products', component_property='children'),
+    Input(component_id='input_iso3', component_property='value'),
+)
+@figure_cache.cachedCallback("update_top_products")
+def update_top_products(countries_selected):
+    countries = data.df_paises.loc[data.df_paises["Nombre_pais"].isin(countries_selected or []), ["Nombre_pais", "iso3"]]
+    if countries.empty:
+        return html.P("Elija un país para ver los productos con mejor puntaje para exportar a ese país", style={'textAlign':'center'})
+    country, country_iso3 = countries.sort_values("Nombre_pais").iloc[0]
+    dff = country_index.topItems("producto", country_iso3, 10)
+    dff = dff[["Ranking", "label_productos", "Demanda", "Arancel"]].rename(columns={"label_productos": "Producto"})
+    return [
+        html.P(f"Los 10 productos con el mayor puntaje medio de demanda y arancel en {country}", style={'textAlign':'center'}),
+        dash_table.DataTable(
+                    columns=[{"name": c, "id": c} for c in dff.columns],
+                    data=dff.to_dict("records"),
+                    style_cell={'textAlign': 'center','font-family':'Segoe UI'}, style_as_list_view=True,
+                    style_data={'color': 'white','backgroundColor': '#152F4F'},
+                    style_header={'backgroundColor': '#373B44','color': 'white','fontWeight': 'bold'},
+                    sort_action="native", export_format="xlsx",
+                ),
+    ]
+
 # Create bar chart of indexes change in last 10 years based on the selected countries
 @app.callback(
     Output(component_id='bar_country', component_property='figure'),
     Input(component_id='input_iso3', component_property='value'),
 )
+@figure_cache.cachedCallback("update_bar")
 def update_scatter(countries_selected):
     countries_selected.sort()
     #Selecting all the iso3 codes of the countries selected
-    countries_iso3 = df_paises.loc[df_paises["Nombre_pais"].isin(countries_selected), "iso3"].tolist()
+    countries_iso3 = data.df_paises.loc[data.df_paises["Nombre_pais"].isin(countries_selected), "iso3"].tolist()
     #Filtering the indexes data by countries selected
-    dff_0 = df_idx_var.loc[df_idx_var["iso3"].isin(countries_iso3)]
+    dff_0 = data.df_idx_var.loc[data.df_idx_var["iso3"].isin(countries_iso3)]
     #Melting the dataframe for easier use when constructing the plot
     df_bar = pd.melt(dff_0, id_vars=['País','Índice'], var_name='year',value_name='value_idx', 
                           value_vars=["2012","2017","2021"])
@@ -238,6 +342,7 @@ def update_scatter(countries_selected):
     [Input(component_id='input_iso3', component_property='value'),
     Input(component_id='productos-dpdn', component_property='value'),]
 )
+@figure_cache.cachedCallback("update_scatter")
 def update_scatter(countries_selected, products_selected):
     #Sorting the countries selected alpabhetically to avoid selection problems
     countries_selected.sort()
@@ -250,14 +355,17 @@ def update_scatter(countries_selected, products_selected):
         #This loop adds scatter traces (points) for each country selected
         for idx, country in enumerate(countries_selected):
             #Getting the country ISO3 code
-            country_iso3 = df_paises.loc[df_paises["Nombre_pais"]==country, "iso3"].iloc[0]
+            country_iso3 = data.df_paises.loc[data.df_paises["Nombre_pais"]==country, "iso3"].iloc[0]
             #Getting the sector code based on the product (HS2 from the HS6)
-            nombres_subsectores = df_relaciones_productos.loc[df_relaciones_productos["producto"].isin(products_selected),"subsector"].unique().tolist()
-            productos_subsector = df_relaciones_productos.loc[df_relaciones_productos["subsector"].isin(nombres_subsectores),"producto"].tolist()
+            nombres_subsectores = data.df_relaciones_productos.loc[data.df_relaciones_productos["producto"].isin(products_selected),"subsector"].unique().tolist()
+            productos_subsector = data.df_relaciones_productos.loc[data.df_relaciones_productos["subsector"].isin(nombres_subsectores),"producto"].tolist()
             #Filtering the data based on sector code and countries ISO3 
-            dff = df_productos.loc[(df_productos["iso3"]==country_iso3) & (df_productos["producto"].isin(productos_subsector)), ["iso3","producto","Demanda","Arancel"]]
-            desc_productos = df_relaciones_productos.loc[df_relaciones_productos["producto"].isin(productos_subsector),["label_productos","producto"]]
-            dff_1 = pd.merge(dff, desc_productos, on='producto', how='left')
+            present = score_engine.getPresent("producto", productos_subsector, [country_iso3])[:, 0]
+            dff = pd.DataFrame(score_engine.getScores("producto", productos_subsector, [country_iso3])[:, 0], columns=["Demanda","Arancel"])
+            dff.insert(0, "producto", productos_subsector)
+            dff.insert(0, "iso3", country_iso3)
+            dff = dff.loc[present]
+            dff_1 = dff.assign(label_productos=dff["producto"].map(data.product_labels))
             #Adding each country trace to the plot
             fig.add_trace(go.Scatter(
                             x=dff_1["Demanda"], y=dff_1["Arancel"],
@@ -0,0 +1,93 @@
+import functools
+import numpy as np
+import pandas as pd
+from apps import data
+from apps import score_engine
+
+#---------------------------------------------------------------
+#Axes of the radar of each version, as in radar.py. The score of a market is the weighted mean of its axes
+AXES = {"Competitividad": ["Sostenibilidad/EPI", "Innovación", "Competitividad", "Distancia", "Arancel", "Demanda"],
+        "Oportunidad": ["Sostenibilidad", "Desarrollo", "Oportunidad", "Arancel", "Demanda"]}
+#Axes that depend on the product, taken from the score arrays. The others are the indexes of the country
+PRODUCT_AXES = ["Arancel", "Demanda"]
+#Number of products ranked at once, which bounds the memory of the rankings of many products
+BATCH_PRODUCTS = 1000
+#Selections of at most this many products keep their feature matrix, so they are ranked again with other weights at once
+SELECTION_PRODUCTS = 50
+
+#----------------------------------------------------------------------------
+# This module ranks the best markets (destination countries) for products. For each product, the score of every country is
+# the weighted mean of the radar axes, with the missing values as 0 like in the radar. The axes of all the countries and
+# products are gathered in a feature matrix of shape (products, countries, axes), and the scores are its product with the
+# vector of weights. Only the top n of each product are sorted (np.argpartition), so ranking all the products is fast.
+# The feature matrix of the products selected in the radar page is kept, so moving the weights only repeats the product.
+
+#Function to get the weights of the axes of a radar version, normalized to add up to 1. The axes without a weight get 1
+def getWeights(radar_v, weights=None):
+    weights = dict(weights or {})
+    unknown = sorted(set(weights) - set(AXES[radar_v]))
+    if unknown:
+        raise ValueError(f"The axes {unknown} are not in the radar {radar_v}")
+    values = np.array([float(weights.get(axis, 1.0)) for axis in AXES[radar_v]])
+    if (values < 0).any() or values.sum() <= 0:
+        raise ValueError("The weights can't be negative or all 0")
+    return values / values.sum()
+
+#Function to get the indexes of the n largest values of each row of a matrix, from the largest
+def topIndices(matrix, n):
+    n = min(n, matrix.shape[1])
+    idx_top = np.argpartition(-matrix, n - 1, axis=1)[:, :n]
+    order = np.argsort(-np.take_along_axis(matrix, idx_top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(idx_top, order, axis=1)
+
+#Function to get the markets (every country but Colombia, the exporting country) and their axes that don't depend on the
+#product, with the missing values as 0. They are computed once for each radar version
+@functools.lru_cache(maxsize=None)
+def getCountryFeatures(radar_v):
+    country_axes = [axis for axis in AXES[radar_v] if axis not in PRODUCT_AXES]
+    df_countries = data.df_paises.loc[data.df_paises["iso3"] != "COL"]
+    return df_countries[["iso3", "Nombre_pais"]].reset_index(drop=True), np.nan_to_num(df_countries[country_axes].to_numpy(dtype=np.float64))
+
+#Function to get the feature matrix of some products, of shape (products, countries, axes), with the axes of the radar version
+def getFeatures(productos, radar_v):
+    axes = AXES[radar_v]
+    df_countries, x_country = getCountryFeatures(radar_v)
+    features = np.empty((len(productos), len(df_countries.index), len(axes)))
+    features[:, :, [axes.index(axis) for axis in axes if axis not in PRODUCT_AXES]] = x_country[np.newaxis, :, :]
+    features[:, :, [axes.index(axis) for axis in PRODUCT_AXES]] = np.nan_to_num(
+        score_engine.getScores("producto", list(productos), df_countries["iso3"], PRODUCT_AXES))
+    return features
+
+#Feature matrices of the last selections of a few products
+getSelectionFeatures = functools.lru_cache(maxsize=32)(getFeatures)
+
+#Function to rank the n best markets of each product. Returns a dataframe with one row per product and market, in the order
+#of the products and the ranking, with the score and the axes of each market
+def rankMarkets(productos, radar_v="Competitividad", n=10, weights=None):
+    axes = AXES[radar_v]
+    weights = getWeights(radar_v, weights)
+    df_countries, _ = getCountryFeatures(radar_v)
+    unknown = [producto for producto, code in zip(productos, score_engine.itemCodes("producto", productos)) if code < 0]
+    if unknown:
+        raise ValueError(f"Unknown products: {unknown[:10]}")
+    results = []
+    for start in range(0, len(productos), BATCH_PRODUCTS):
+        chunk = tuple(productos[start:start + BATCH_PRODUCTS])
+        features = getSelectionFeatures(chunk, radar_v) if len(productos) <= SELECTION_PRODUCTS else getFeatures(chunk, radar_v)
+        #The score of every market of every product at once
+        scores = features @ weights
+        idx_top = topIndices(scores, n)
+        n_top = idx_top.shape[1]
+        idx_rows = np.repeat(np.arange(len(chunk)), n_top)
+        idx_countries = idx_top.ravel()
+        dff = pd.DataFrame({"producto": np.repeat(np.array(chunk, dtype=object), n_top), "Ranking": np.tile(np.arange(1, n_top + 1), len(chunk)),
+                            "iso3": df_countries["iso3"].to_numpy()[idx_countries], "Nombre_pais": df_countries["Nombre_pais"].to_numpy()[idx_countries],
+                            "Puntaje": scores[idx_rows, idx_countries]})
+        dff[axes] = features[idx_rows, idx_countries]
+        results.append(dff)
+    columns = ["producto", "Ranking", "iso3", "Nombre_pais", "Puntaje"] + axes
+    return pd.concat(results, ignore_index=True)[columns] if results else pd.DataFrame(columns=columns)
+
+#Function to rank the n best markets of every product
+def rankAllMarkets(radar_v="Competitividad", n=10, weights=None):
+    return rankMarkets(score_engine.getItems("producto"), radar_v, n, weights)
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import threading
+from apps import data
+
+#Item column for each level of the product hierarchy
+LEVELS = ["producto", "sector", "subsector"]
+METRICS = ["Oferta", "Demanda", "Arancel"]
+
+#----------------------------------------------------------------------------
+# This module keeps the product, sector and subsector scores as dense arrays of shape (items, countries, metrics).
+# Every lookup is a direct indexing by integer codes instead of a boolean-mask scan over the dataframes.
+# The arrays have one extra item and one extra country filled with NaN, so unknown codes (-1) fall on them.
+# With the compact data (See data.COMPACT) the arrays are float32, and the scores are given back as the float64 values of the files.
+
+_iso3_codes = None
+_item_codes = {}
+_scores = {}
+_present = {}
+_lock = threading.Lock()
+
+#Function to build the arrays from the dataframes of each level
+def buildEngine(frames):
+    global _iso3_codes
+    #The same country codes are shared by all the levels
+    iso3_list = sorted(set().union(*[df["iso3"].dropna().unique() for df in frames.values()]))
+    iso3_codes = {iso3: idx for idx, iso3 in enumerate(iso3_list)}
+    iso3_index = pd.Index(iso3_list)
+    for level, df in frames.items():
+        items = pd.Index(df[level].dropna().unique())
+        _item_codes[level] = {item: idx for idx, item in enumerate(items)}
+        idx_items = items.get_indexer(df[level])
+        idx_iso3 = iso3_index.get_indexer(df["iso3"])
+        dtype = np.float32 if (df[METRICS].dtypes == np.float32).all() else np.float64
+        scores = np.full((len(items) + 1, len(iso3_list) + 1, len(METRICS)), np.nan, dtype=dtype)
+        scores[idx_items, idx_iso3] = df[METRICS].to_numpy(dtype=dtype)
+        present = np.zeros((len(items) + 1, len(iso3_list) + 1), dtype=bool)
+        present[idx_items, idx_iso3] = True
+        #The rows with unknown item or country are cleared from the NaN row and column
+        scores[-1, :] = np.nan
+        scores[:, -1] = np.nan
+        present[-1, :] = False
+        present[:, -1] = False
+        _scores[level] = scores
+        _present[level] = present
+    #The country codes are set last, because loadEngine uses them to know that the arrays are ready
+    _iso3_codes = iso3_codes
+
+#Function to build the arrays from the shared data the first time they are needed
+def loadEngine():
+    if _iso3_codes is None:
+        with _lock:
+            if _iso3_codes is None:
+                buildEngine({"producto": data.df_productos, "sector": data.df_sectores, "subsector": data.df_subsectores})
+
+#Functions to translate items and countries to the integer codes of the arrays
+def itemCodes(level, items):
+    loadEngine()
+    codes = _item_codes[level]
+    return np.array([codes.get(item, -1) for item in items], dtype=np.intp)
+
+def iso3Codes(countries_iso3):
+    loadEngine()
+    return np.array([_iso3_codes.get(iso3, -1) for iso3 in countries_iso3], dtype=np.intp)
+
+#Function to get the scores for every (item, country) pair. Returns an array of shape (items, countries, metrics), NaN when there is no data
+def getScores(level, items, countries_iso3, metrics=("Demanda", "Arancel")):
+    idx_items = itemCodes(level, items)
+    idx_iso3 = iso3Codes(countries_iso3)
+    idx_metrics = [METRICS.index(metric) for metric in metrics]
+    scores = _scores[level][np.ix_(idx_items, idx_iso3, idx_metrics)]
+    if scores.dtype == np.float32:
+        return np.round(scores.astype(np.float64), data.SCORE_DECIMALS)
+    return scores
+
+#Function to know which (item, country) pairs have a row in the original data. Returns a boolean array of shape (items, countries)
+def getPresent(level, items, countries_iso3):
+    idx_items = itemCodes(level, items)
+    idx_iso3 = iso3Codes(countries_iso3)
+    return _present[level][np.ix_(idx_items, idx_iso3)]
+
+
+#Function to get all the items of a level, in the order of their codes
+def getItems(level):
+    loadEngine()
+    return list(_item_codes[level])
+
+#Function to get the memory used by the arrays, in bytes
+def memoryUsage():
+    loadEngine()
+    return sum(array.nbytes for arrays in [_scores, _present] for array in arrays.values())
+
+#Function to get all the countries (iso3), in the order of their codes
+def getCountries():
+    loadEngine()
+    return list(_iso3_codes)
@@ -0,0 +1,155 @@
+import json
+import math
+import numpy as np
+import operator
+import pandas as pd
+from dash import dcc
+from dash import html
+from dash import dash_table
+import dash_bootstrap_components as dbc
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from apps import figure_cache
+from apps import metrics
+
+#----------------------------------------------------------------------------
+# This module pages, sorts and filters the results tables on the server ("custom" actions of the DataTable), so only the
+# rows of the visible page are sent to the browser. The full frame of each table is kept in the figure cache, keyed on
+# the table name and the arguments that built it, and a store next to the table holds those arguments. If the frame is
+# no longer cached, it is built again with the function registered for the table. That function returns None when the
+# frame can't be built in the request (e.g. it needs a background job), and the page is empty until it can.
+# The export button of a table downloads all its rows as CSV, filtered and sorted like the table.
+
+#Functions that build the frame of each table from its arguments
+_builders = {}
+
+#Operators of the filter expressions of the DataTable, with their synonyms, e.g. "{País} contains Chi && {Clúster} >= 2"
+FILTER_OPERATORS = [["ge ", ">="], ["le ", "<="], ["lt ", "<"], ["gt ", ">"], ["ne ", "!="], ["eq ", "="], ["contains "], ["datestartswith "]]
+COMPARISONS = {"ge": operator.ge, "le": operator.le, "lt": operator.lt, "gt": operator.gt, "ne": operator.ne, "eq": operator.eq}
+
+#Function to get the cache key of the frame of a table
+def frameKey(name, args):
+    return figure_cache.cacheKey(f"table_{name}", args)
+
+#Function to convert a frame to its compact form: its columns and its rows
+def frameData(dff):
+    return json.loads(dff.to_json(orient="split", index=False, force_ascii=False))
+
+#Function to convert a frame in its compact form back to a dataframe
+def toFrame(frame):
+    return pd.DataFrame(frame["data"], columns=frame["columns"])
+
+#Function to keep the frame of a table, given as a dataframe or in its compact form
+def saveFrame(name, args, frame, disk=True):
+    if isinstance(frame, pd.DataFrame):
+        frame = frameData(frame)
+    figure_cache.put(frameKey(name, args), json.dumps(frame, ensure_ascii=False), disk=disk)
+
+#Function to get the frame of a table from the cache, or build it again
+def getFrame(name, args):
+    key = frameKey(name, args)
+    payload, result = figure_cache.lookup(key)
+    metrics.recordCache(f"table_{name}", result)
+    if payload is None:
+        dff = _builders[name](*args)
+        if dff is None:
+            return pd.DataFrame()
+        saveFrame(name, args, dff)
+        return dff
+    return toFrame(json.loads(payload))
+
+#Function to split a part of a filter expression in its column, operator and value
+def splitFilterPart(filter_part):
+    for operator_type in FILTER_OPERATORS:
+        for operator_name in operator_type:
+            if operator_name in filter_part:
+                name_part, value_part = filter_part.split(operator_name, 1)
+                name = name_part[name_part.find("{") + 1: name_part.rfind("}")]
+                value_part = value_part.strip()
+                #Quoted values are always text, and so are the values of the text operators. The others are numbers when they can be
+                if len(value_part) > 1 and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', "`"):
+                    value = value_part[1:-1].replace("\\" + value_part[0], value_part[0])
+                elif operator_type[0] in ("contains ", "datestartswith "):
+                    value = value_part
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return None, None, None
+
+#Function to get the rows of a frame that pass a filter expression, evaluated on whole columns
+def filterFrame(dff, filter_query):
+    if not filter_query:
+        return dff
+    mask = np.ones(len(dff.index), dtype=bool)
+    for filter_part in filter_query.split(" && "):
+        column, operator_name, value = splitFilterPart(filter_part)
+        if column not in dff.columns:
+            continue
+        if operator_name == "contains":
+            mask &= dff[column].astype(str).str.contains(str(value), regex=False).to_numpy()
+        elif operator_name == "datestartswith":
+            mask &= dff[column].astype(str).str.startswith(str(value)).to_numpy()
+        else:
+            try:
+                mask &= COMPARISONS[operator_name](dff[column], value).to_numpy(dtype=bool)
+            except TypeError:
+                #A text compared with a number matches nothing
+                mask[:] = False
+    return dff.loc[mask]
+
+#Function to sort a frame by the columns of the DataTable sort_by property
+def sortFrame(dff, sort_by):
+    sort_by = [col for col in (sort_by or []) if col["column_id"] in dff.columns]
+    if not sort_by:
+        return dff
+    return dff.sort_values([col["column_id"] for col in sort_by], ascending=[col["direction"] == "asc" for col in sort_by],
+                           kind="mergesort")
+
+#Function to get the rows of the frame of a table shown with a filter and an order
+def tableRows(frame, filter_query, sort_by):
+    return sortFrame(filterFrame(getFrame(frame["name"], tuple(frame["args"])), filter_query), sort_by)
+
+#Function to make a results table that is paged, sorted and filtered on the server. The frame is saved for the paging
+#and export callbacks (See registerTable) and the table starts empty, its first page is sent by the paging callback
+def pagedTable(table_id, name, args, dff, **table_args):
+    saveFrame(name, args, dff)
+    numeric = dff.select_dtypes("number").columns
+    return html.Div([
+        dbc.Button("Exportar", id=f"{table_id}-export", size="sm", color="secondary", style={"margin": "8px 0"}),
+        dcc.Download(id=f"{table_id}-download"),
+        dash_table.DataTable(id=table_id,
+                             columns=[{"name": c, "id": c, "type": "numeric" if c in numeric else "text"} for c in dff.columns],
+                             data=[], page_current=0, page_action="custom", **table_args),
+        dcc.Store(id=f"{table_id}-frame", data={"name": name, "args": list(args)}),
+    ])
+
+#Function to register the paging and export callbacks of a table and the function that builds its frame
+def registerTable(app, table_id, name, builder):
+    _builders[name] = builder
+
+    def updatePage(page_current, page_size, sort_by, filter_query, frame):
+        dff = tableRows(frame, filter_query, sort_by)
+        start = (page_current or 0) * page_size
+        return dff.iloc[start:start + page_size].to_dict("records"), max(math.ceil(len(dff.index) / page_size), 1)
+
+    def exportTable(n_clicks, sort_by, filter_query, frame):
+        if not n_clicks:
+            raise PreventUpdate
+        return dcc.send_data_frame(tableRows(frame, filter_query, sort_by).to_csv, f"{name}.csv", index=False)
+    #Each table has its own callbacks, named after it in the metrics and the profiles
+    updatePage.__name__ = f"page_{name}"
+    exportTable.__name__ = f"export_{name}"
+    app.callback(
+        [Output(table_id, "data"), Output(table_id, "page_count")],
+        [Input(table_id, "page_current"), Input(table_id, "page_size"), Input(table_id, "sort_by"), Input(table_id, "filter_query")],
+        State(f"{table_id}-frame", "data")
+    )(updatePage)
+    app.callback(
+        Output(f"{table_id}-download", "data"),
+        Input(f"{table_id}-export", "n_clicks"),
+        [State(table_id, "sort_by"), State(table_id, "filter_query"), State(f"{table_id}-frame", "data")],
+        prevent_initial_call=True
+    )(exportTable)
@@ -0,0 +1,35 @@
+// Clientside callbacks to fill the sector -> subsector -> product dropdowns from the hierarchy in the
+// "jerarquia-productos" store (See apps/cascade.py). They return the same options as the server callbacks did.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    cascade: {
+        // Options of a list of labels, the value of a product is its HS6 code
+        productOptions: function(jerarquia, subsector) {
+            var productos = jerarquia.productos;
+            var labels = productos;
+            if (subsector !== null && subsector !== undefined) {
+                labels = (jerarquia.subsectores[subsector] || []).map(function(idx) { return productos[idx]; });
+            }
+            return labels.map(function(label) { return {label: label, value: label.slice(0, 6)}; });
+        },
+        subsectorOptions: function(jerarquia, sector) {
+            return (jerarquia.sectores[sector] || []).map(function(subsector) { return {label: subsector, value: subsector}; });
+        },
+        // Radar page
+        radarSubsectores: function(sector, jerarquia) {
+            return window.dash_clientside.cascade.subsectorOptions(jerarquia, sector);
+        },
+        radarProductos: function(subsector, jerarquia) {
+            return window.dash_clientside.cascade.productOptions(jerarquia, subsector);
+        },
+        // Model page, where the sector "Todos" disables the subsectors dropdown
+        modelSubsectores: function(sector, jerarquia) {
+            if (sector === "Todos") {
+                return [true, []];
+            }
+            return [false, window.dash_clientside.cascade.subsectorOptions(jerarquia, sector)];
+        },
+        modelProductos: function(subsector, jerarquia) {
+            return ["090111", window.dash_clientside.cascade.productOptions(jerarquia, subsector)];
+        }
+    }
+});
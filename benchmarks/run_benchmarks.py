@@ -0,0 +1,160 @@
+import numpy as np
+import json
+import os
+import pathlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmarks import synthetic_data
+
+#----------------------------------------------------------------------------
+# This module times the main functions of the app and the data cleaning script on synthetic data of different sizes.
+# Run from the repository root:
+#   python -m benchmarks.run_benchmarks [--sizes 60x300,120x1500] [--repeat 30] [--output results.json]
+# Each size is "<countries>x<products>". The data of each size is generated in a temporary folder and the functions are timed
+# in a new process with RADAR_DATA_PATH pointing to it, so every size starts with empty caches.
+# The report has the latency percentiles of each function, the peak of the memory allocated by one call (tracemalloc)
+# and the peak resident memory of the whole process. The boot of the app is timed too, for each warmup mode of index.py.
+
+SIZES = "60x300,120x1500"
+REPEAT = 30
+#The ETL and the boot of the app are much slower than the callbacks, so they are run fewer times
+ETL_REPEAT = 3
+BOOT_REPEAT = 3
+#Warmup modes of index.py whose boot time is measured
+WARMUP_MODES = ["eager", "lazy"]
+REPO_PATH = pathlib.Path(__file__).parent.parent
+RADAR_VERSIONS = ["Competitividad", "Oportunidad"]
+
+#Function to time a function over a list of argument tuples. Returns the latencies in ms and the peak memory of one call in MB
+def timeCalls(func, calls):
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    #The memory is measured on a separate call because tracemalloc slows down the allocations
+    tracemalloc.start()
+    func(*calls[-1])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, peak / 1024 ** 2
+
+#Function to summarize the latencies of a benchmark
+def summarize(latencies, peak_mb):
+    return {"calls": len(latencies), "mean_ms": float(np.mean(latencies)), "p50_ms": float(np.percentile(latencies, 50)),
+            "p90_ms": float(np.percentile(latencies, 90)), "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(np.max(latencies)), "peak_mb": peak_mb}
+
+#Function to run the ETL on the raw files of a folder, with one worker so the timing doesn't depend on the host
+def runETL(folder):
+    from apps import data_cleaning_demand_tariff
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        data_cleaning_demand_tariff.main(workers=1)
+    finally:
+        os.chdir(cwd)
+
+#Function to run all the benchmarks in this process, on the data of RADAR_DATA_PATH. Returns the results of each benchmark
+def runWorker(folder, repeat):
+    results = {}
+    start = time.perf_counter()
+    from apps import data
+    from apps import score_engine
+    from apps import radar_df
+    from apps import cluster
+    score_engine.loadEngine()
+    results["load"] = summarize([(time.perf_counter() - start) * 1000], 0.0)
+
+    rng = np.random.default_rng(0)
+    #Colombia is not a target market, so it is never the first selected country
+    nombres = sorted(data.df_paises.loc[data.df_paises["iso3"] != "COL", "Nombre_pais"])
+    iso3 = data.df_paises.loc[data.df_paises["iso3"] != "COL", "iso3"].tolist()
+    productos = sorted(data.df_relaciones_productos["producto"].unique())
+    sectores = data.df_relaciones_productos[["sector", "subsector"]].drop_duplicates().to_numpy().tolist()
+
+    def randomChoice(values, size=None):
+        idx = rng.choice(len(values), size=size, replace=False)
+        return [values[i] for i in idx] if size is not None else values[idx]
+
+    def radarVersion(i):
+        return RADAR_VERSIONS[i % len(RADAR_VERSIONS)]
+
+    benchmarks = {
+        "get_radar_products": (radar_df.get_radar_products,
+                               [(randomChoice(nombres, 3), randomChoice(productos, 3), radarVersion(i)) for i in range(repeat)]),
+        "get_radar_sectors": (radar_df.get_radar_sectors,
+                              [(randomChoice(nombres, 3), *randomChoice(sectores), radarVersion(i)) for i in range(repeat)]),
+        "getClusterModel": (cluster.getClusterModel, [(randomChoice(productos), radarVersion(i)) for i in range(repeat)]),
+        "getRecommendedCountries": (cluster.getRecommendedCountries,
+                                    [(randomChoice(productos), randomChoice(iso3), radarVersion(i)) for i in range(repeat)]),
+        "getRecommendedCountries[neighbors]": (lambda *args: cluster.getRecommendedCountries(*args, mode="neighbors"),
+                                               [(randomChoice(productos), randomChoice(iso3), radarVersion(i)) for i in range(repeat)]),
+    }
+    for name, (func, calls) in benchmarks.items():
+        results[name] = summarize(*timeCalls(func, calls))
+    results["etl"] = summarize(*timeCalls(runETL, [(folder,)] * ETL_REPEAT))
+    #ru_maxrss is in KB on Linux
+    results["process"] = {"max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    return results
+
+#Function to time the boot of the app (importing index.py) in new processes with a warmup mode
+def timeBoot(env, mode):
+    latencies = []
+    for _ in range(BOOT_REPEAT):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import index"], cwd=REPO_PATH, env=dict(env, RADAR_WARMUP=mode),
+                       capture_output=True, check=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return summarize(latencies, 0.0)
+
+#Function to generate the data of a size and run the benchmarks on it in a new process
+def runSize(n_countries, n_products, repeat):
+    with tempfile.TemporaryDirectory(prefix="radar_bench_") as folder:
+        folder = pathlib.Path(folder)
+        synthetic_data.writeAppData(folder.joinpath("data"), n_countries, n_products)
+        synthetic_data.writeRawData(folder.joinpath("raw_data"), n_countries, n_products)
+        env = dict(os.environ, RADAR_DATA_PATH=str(folder.joinpath("data")))
+        output = subprocess.run([sys.executable, "-m", "benchmarks.run_benchmarks", "--worker", str(folder), "--repeat", str(repeat)],
+                                env=env, capture_output=True, text=True)
+        if output.returncode != 0:
+            raise RuntimeError(f"The benchmarks failed for {n_countries}x{n_products}:\n{output.stderr}")
+        #The results are the last line of the output, the previous ones are the prints of the app modules
+        results = json.loads(output.stdout.strip().splitlines()[-1])
+        for mode in WARMUP_MODES:
+            results[f"boot[{mode}]"] = timeBoot(env, mode)
+        return results
+
+#Function to print the results as a table
+def printReport(report):
+    print(f"{'size':>12} {'benchmark':<36} {'calls':>5} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'peak MB':>8}")
+    for size, results in report.items():
+        for name, result in results.items():
+            if name == "process":
+                continue
+            print(f"{size:>12} {name:<36} {result['calls']:>5} {result['p50_ms']:>9.2f} {result['p90_ms']:>9.2f} "
+                  f"{result['p99_ms']:>9.2f} {result['max_ms']:>9.2f} {result['peak_mb']:>8.2f}")
+        print(f"{size:>12} {'max RSS of the process':<36} {results['process']['max_rss_mb']:>61.1f}")
+
+#Function to get the value of a command line option
+def getOption(name, default):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+if __name__ == '__main__':
+    repeat = int(getOption("--repeat", REPEAT))
+    if "--worker" in sys.argv:
+        print(json.dumps(runWorker(getOption("--worker", None), repeat)))
+    else:
+        report = {}
+        for size in getOption("--sizes", SIZES).split(","):
+            n_countries, n_products = [int(n) for n in size.split("x")]
+            print(f"Running the benchmarks with {n_countries} countries and {n_products} products...")
+            report[size] = runSize(n_countries, n_products, repeat)
+        printReport(report)
+        if "--output" in sys.argv:
+            with open(getOption("--output", None), "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
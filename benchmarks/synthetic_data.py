@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+import pathlib
+import sys
+
+#----------------------------------------------------------------------------
+# This module writes synthetic versions of the data files of the app, with the same columns and format as the real ones,
+# for any number of countries and products. It can also write the raw files read by the data cleaning script.
+# Run from the repository root:
+#   python -m benchmarks.synthetic_data <folder> [--countries N] [--products N] [--seed N] [--raw]
+# The first country is always Colombia and the first product 090111, which the app uses as defaults.
+
+SECTORES = ["Agroindustrial", "Metalmecánica", "Químicos", "Manufacturas", "Prendas"]
+REGIONES = ["America", "Europa", "Asia", "Africa", "Oceania"]
+ACUERDOS = ["CAN", "UE", "Alianza del Pacífico", "Mercosur", "Ninguno"]
+INDICES = ["EPI", "Innovación", "Competitividad", "Distancia"]
+
+#Function to get the iso3 codes and names of the countries
+def getCountries(n_countries):
+    iso3 = ["COL"] + ["".join(chr(65 + (idx // 26 ** p) % 26) for p in [2, 1, 0]) for idx in range(1, n_countries)]
+    nombres = ["Colombia"] + [f"País {idx}" for idx in range(1, n_countries)]
+    return iso3, nombres
+
+#Function to get the product codes and the sector and subsector of each product
+def getProducts(n_products, rng):
+    codes = rng.choice(np.arange(10000, 999999), n_products, replace=False)
+    productos = ["090111"] + [f"{code:06d}" for code in codes[1:]]
+    sectores = rng.choice(SECTORES, n_products)
+    subsectores = np.array([f"{sector}-{idx}" for sector, idx in zip(sectores, rng.integers(4, size=n_products))])
+    return productos, sectores, subsectores
+
+#Function to get random scores on the 0-5 scale
+def getScores(rng, size, decimals=2):
+    return (rng.random(size) * 5).round(decimals)
+
+#Function to write the data files of the app to a folder
+def writeAppData(path, n_countries=60, n_products=300, seed=0, coverage=0.9):
+    rng = np.random.default_rng(seed)
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    iso3, nombres = getCountries(n_countries)
+    productos, sectores, subsectores = getProducts(n_products, rng)
+
+    df_paises = pd.DataFrame({"iso3": iso3, "nombre": nombres})
+    for column in ["epi", "innovacion", "competitividad", "distancia"]:
+        df_paises[column] = getScores(rng, n_countries)
+    df_paises["Region"] = rng.choice(REGIONES, n_countries)
+    for column in ["Sostenibilidad", "Desarrollo", "Oportunidad"]:
+        df_paises[column] = getScores(rng, n_countries)
+    df_paises["comercial"] = rng.choice(ACUERDOS, n_countries)
+    df_paises.to_csv(path.joinpath("df_indices_paises.csv"), sep=";", index=False)
+
+    df_idx_var = pd.DataFrame({"iso3": np.repeat(iso3, len(INDICES)), "País": np.repeat(nombres, len(INDICES)),
+                               "Índice": np.tile(INDICES, n_countries)})
+    for year in ["2012", "2017", "2021"]:
+        df_idx_var[year] = getScores(rng, len(df_idx_var.index))
+    df_idx_var.to_csv(path.joinpath("df_idx_var.csv"), sep=";", index=False)
+
+    pd.DataFrame({"sector": sectores, "subsector": subsectores, "producto": productos,
+                  "desc_producto": [f"Producto {producto}" for producto in productos]}).to_csv(
+        path.joinpath("relaciones_productos.csv"), sep=";", index=False)
+
+    #Not every country has scores for every product
+    idx_products, idx_countries = np.nonzero(rng.random((n_products, n_countries)) < coverage)
+    df_productos = pd.DataFrame({"iso3": np.array(iso3)[idx_countries], "producto": np.array(productos)[idx_products]})
+    for column in ["Oferta", "Demanda", "Arancel"]:
+        df_productos[column] = getScores(rng, len(df_productos.index))
+    df_productos.to_csv(path.joinpath("df_productos.csv"), index=False)
+
+    for level, items in [("sector", sorted(set(sectores))), ("subsector", sorted(set(subsectores)))]:
+        df_level = pd.DataFrame({"iso3": np.tile(iso3, len(items)), level: np.repeat(items, n_countries)})
+        df_level["Oferta"] = getScores(rng, len(df_level.index))
+        df_level["Demanda"] = getScores(rng, len(df_level.index))
+        df_level["Arancel"] = getScores(rng, len(df_level.index), 3)
+        df_level.to_csv(path.joinpath(f"df_{level}es.csv"), index=False)
+
+#Function to write the raw files read by apps/data_cleaning_demand_tariff.py to a folder
+def writeRawData(path, n_countries=60, n_products=300, seed=0, coverage=0.9):
+    rng = np.random.default_rng(seed)
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    iso3, nombres = getCountries(n_countries)
+    productos, sectores, subsectores = getProducts(n_products, rng)
+    pd.DataFrame({"Name": nombres, "ISO3": iso3}).to_csv(path.joinpath("relacion_codigos_iso3.csv"), sep=";", index=False)
+    pd.DataFrame({"sector": sectores, "subsector": subsectores, "producto": productos,
+                  "desc_producto": [f"Producto {producto}" for producto in productos]}).to_csv(
+        path.joinpath("relaciones_productos.csv"), sep=";", index=False)
+    #The raw files also have territories without iso3 code
+    paises = nombres + ["Territorio 1", "Territorio 2"]
+
+    def rawScores(df):
+        for column in ["s_p_general", "s_p_o_general", "s_p_d_general"]:
+            df[column] = rng.random(len(df.index))
+        return df
+
+    for file_name, column, items in [("sector.txt", "Sector", sorted(set(sectores))), ("subsector.txt", "Subsector", sorted(set(subsectores)))]:
+        df_level = pd.DataFrame({"Pais": np.tile(paises, len(items)), column: np.repeat(items, len(paises))})
+        rawScores(df_level).to_csv(path.joinpath(file_name), sep="|", index=False)
+    idx_products, idx_countries = np.nonzero(rng.random((n_products, len(paises))) < coverage)
+    df_producto = rawScores(pd.DataFrame({"Pais": np.array(paises)[idx_countries], "CD_Producto": np.array(productos)[idx_products]}))
+    df_producto.to_csv(path.joinpath("producto.txt"), sep="|", index=False)
+    #The tariffs file has the product codes without their leading zero and missing tariffs
+    df_aranceles = df_producto[["Pais", "CD_Producto"]].sample(frac=0.8, random_state=seed)
+    tariffs = rng.choice([0, 5, 10, 15, 20, 35, 100, np.nan], len(df_aranceles.index))
+    pd.DataFrame({"Arancel_Pais_Colombia_T": np.where(rng.random(len(tariffs)) < 0.3, (rng.random(len(tariffs)) * 40).round(1), tariffs),
+                  "pais": df_aranceles["Pais"].to_numpy(),
+                  "Código del producto": df_aranceles["CD_Producto"].str.lstrip("0").to_numpy()}).to_csv(
+        path.joinpath("aranceles.csv"), sep=";", index=False)
+
+#Function to get the value of a command line option
+def getOption(name, default):
+    return int(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+if __name__ == '__main__':
+    folder = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith("--") else "data"
+    options = {"n_countries": getOption("--countries", 60), "n_products": getOption("--products", 300), "seed": getOption("--seed", 0)}
+    if "--raw" in sys.argv:
+        writeRawData(folder, **options)
+    else:
+        writeAppData(folder, **options)
+    print(f"Synthetic data with {options['n_countries']} countries and {options['n_products']} products written to {folder}")
@@ -1,3 +1,9 @@
+import functools
+import gc
+import os
+import threading
+import time
+_boot_start = time.perf_counter()
 from dash import dcc
 from dash import html
 from dash.dependencies import Input, Output
@@ -6,20 +12,52 @@ from dash.dependencies import Input, Output
 from app import app
 from app import server
 
-# Connect to your app pages
+# Connect to your app pages. Importing them only registers their callbacks: the data, the layouts and scikit-learn
+# are loaded the first time they are used, or by the warmup
 from apps import radar, model, disclaimer, inicio
+from apps import data, score_engine, cluster_store, cascade, cluster, country_index
 
-#This perform the routing of the application
-url_content_layout = html.Div(children=[
-    dcc.Location(id="url",refresh=False),
-    html.Div(id="output-div")
-])
+#---------------------------------------------------------------
+#When the data, score arrays, country index, cluster store, scikit-learn and page layouts are loaded:
+#"eager" (default) before the app starts serving, "background" in a thread after the boot and "lazy" on first use
+WARMUP = os.environ.get("RADAR_WARMUP", "eager")
+
+#Function to load everything the callbacks need, so the first requests don't pay for it
+def warmup():
+    start = time.perf_counter()
+    data.loadData()
+    score_engine.loadEngine()
+    country_index.loadIndex()
+    cluster_store.loadStore()
+    cluster.loadSklearn()
+    cascade.getStore()
+    radar.loadLayout()
+    model.loadLayout()
+    #Serializer of the cached figures (See figure_cache.py)
+    import plotly.io.json
+    print(f"Warmup done in {time.perf_counter() - start:.2f}s")
+
+#With the eager warmup and gunicorn --preload, all of it happens once in the master process and the forked workers share the memory pages.
+#gc.freeze moves these objects out of the garbage collector, so its passes don't write to the shared pages.
+#The background warmup must not be used with --preload, because the workers would be forked in the middle of it
+if WARMUP == "eager":
+    warmup()
+    gc.freeze()
+elif WARMUP == "background":
+    threading.Thread(target=warmup, daemon=True).start()
+
+#This perform the routing of the application. The layout is a function, so the product hierarchy is only loaded when the app is first opened
+@functools.lru_cache(maxsize=None)
+def url_content_layout():
+    return html.Div(children=[
+        dcc.Location(id="url",refresh=False),
+        #Product hierarchy used by the dropdowns of the pages, sent once with the main layout
+        cascade.getStore(),
+        html.Div(id="output-div")
+    ])
 app.layout = url_content_layout
-app.validation_layout = html.Div([
-    url_content_layout,
-    radar.layout,
-    model.layout
-])
+#There is no app.validation_layout: Dash doesn't use it with suppress_callback_exceptions (See app.py), and building it
+#would load the data and the page layouts at import
 
 #Callback to create the dinamic routing of the application
 @app.callback(Output(component_id="output-div",component_property="children"),Input(component_id="url",component_property="pathname"))
@@ -33,5 +71,7 @@ def display_page(pathname):
     else:
         return inicio.layout
 
+print(f"Boot done in {time.perf_counter() - _boot_start:.2f}s (RADAR_WARMUP={WARMUP})")
+
 if __name__ == '__main__':
-    app.run_server(debug=False)
\ No newline at end of file
+    app.run_server(debug=False)
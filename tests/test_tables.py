@@ -0,0 +1,29 @@
+import pandas as pd
+from apps import tables
+
+#----------------------------------------------------------------------------
+# Tests of the server-side filters of the results tables (See apps/tables.py)
+
+df = pd.DataFrame({"Identificador": ["090111-Café", "100630-Arroz", "080300-Banano"],
+                   "País": ["Chile 10", "Perú", "Ecuador"],
+                   "Demanda": [4.5, 2.0, 3.25]})
+
+def test_contains_keeps_numeric_looking_values_as_text():
+    assert tables.filterFrame(df, "{Identificador} contains 090111")["Identificador"].tolist() == ["090111-Café"]
+    assert tables.filterFrame(df, "{País} contains 10")["País"].tolist() == ["Chile 10"]
+    assert tables.filterFrame(df, '{País} contains "10"')["País"].tolist() == ["Chile 10"]
+
+def test_datestartswith_keeps_numeric_looking_values_as_text():
+    assert tables.filterFrame(df, "{Identificador} datestartswith 0803")["Identificador"].tolist() == ["080300-Banano"]
+
+def test_comparisons_use_numbers():
+    assert tables.filterFrame(df, "{Demanda} >= 3")["Demanda"].tolist() == [4.5, 3.25]
+    assert tables.filterFrame(df, "{Demanda} lt 3.25")["Demanda"].tolist() == [2.0]
+    assert tables.filterFrame(df, "{Demanda} = 2")["País"].tolist() == ["Perú"]
+
+def test_parts_are_combined_and_unknown_columns_ignored():
+    assert tables.filterFrame(df, "{Demanda} > 2 && {País} contains d")["País"].tolist() == ["Ecuador"]
+    assert tables.filterFrame(df, "{Otra} contains x")["País"].tolist() == df["País"].tolist()
+
+def test_text_compared_with_number_matches_nothing():
+    assert tables.filterFrame(df, "{País} > 2").empty